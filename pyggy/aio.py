@@ -0,0 +1,227 @@
+from collections import namedtuple
+import itertools
+import threading
+
+from .objects import Commit, TreeEntry, Walker
+from .repo import Repo
+
+_default_executor = []
+_default_executor_lock = threading.Lock()
+
+
+class CommitInfo(namedtuple('CommitInfo', ('sha', 'tree', 'parents', 'author', 'committer',
+                                           'commit_time', 'message'))):
+    """the data of a commit, copied out of libgit2 on a repository's thread
+
+    tree and parents are SHAs.  Fields that weren't asked for are None.
+    """
+
+
+class PinnedExecutor(object):
+    """a bounded set of single-threaded executors that repos are pinned to
+
+    Every AsyncRepo is assigned one of the executor's threads for its whole
+    life, so its libgit2 handle is only ever touched from that thread, while
+    the total number of threads stays bounded no matter how many repos are
+    in use.
+    """
+
+    def __init__(self, threads=4):
+        from concurrent.futures import ThreadPoolExecutor
+        self._threads = [ThreadPoolExecutor(1) for _ in xrange(threads)]
+        self._next = itertools.cycle(self._threads)
+        self._lock = threading.Lock()
+
+    def pin(self):
+        """return the single-threaded executor for a new repository"""
+        with self._lock:
+            return next(self._next)
+
+    def shutdown(self, wait=True):
+        for thread in self._threads:
+            thread.shutdown(wait)
+
+
+def default_executor():
+    """return the PinnedExecutor shared by AsyncRepos that weren't given one"""
+    with _default_executor_lock:
+        if not _default_executor:
+            _default_executor.append(PinnedExecutor())
+        return _default_executor[0]
+
+
+class AsyncRepo(object):
+    """an asyncio (trollius) front-end for Repo
+
+    Every method returns a future, to be waited on with yield From(...)
+    in a trollius coroutine, that runs the corresponding Repo operation on
+    the thread this repository is pinned to, so libgit2 I/O and inflation
+    never block the event loop.  The underlying Repo is opened on first use.
+
+    These methods hand back plain data--SHAs, CommitInfos, dicts of
+    TreeEntries, strings--never live Commits or Trees, since loading
+    anything from one of those on the event loop would run libgit2 on the
+    wrong thread.  Use run() for anything not covered here, and don't let
+    it return pyggy objects.
+
+    This needs trollius and futures, which pyggy only installs with its
+    async extra (pip install pyggy[async]).
+    """
+
+    def __init__(self, path, executor=None, **repo_kwargs):
+        self._path = path
+        self._repo_kwargs = repo_kwargs
+        self._repo = None
+        self._thread = (executor or default_executor()).pin()
+
+    def close(self):
+        """close the underlying Repo"""
+        return self._submit(self._close)
+
+    def run(self, fn, *args, **kwargs):
+        """run fn(repo, *args, **kwargs) on this repository's thread"""
+        return self._call(fn, *args, **kwargs)
+
+    def resolve(self, rev):
+        """resolve a SHA, ref, or tag to a full SHA"""
+        return self._call(lambda repo: repo[rev].sha)
+
+    def commit(self, rev, fields=None):
+        """return a CommitInfo for a commit by SHA, ref, or tag
+
+        If fields is given, only that subset of Commit.FIELDS is read.
+        """
+        def commit(repo):
+            commit = repo.commits([repo._resolve_rev(rev)], fields)[0]
+            wanted = Commit.FIELDS if fields is None else frozenset(fields)
+            return CommitInfo(
+                commit.sha,
+                commit.tree.sha if 'tree' in wanted else None,
+                list(commit.parent_ids) if 'parents' in wanted else None,
+                commit.author if 'author' in wanted else None,
+                commit.committer if 'committer' in wanted else None,
+                commit.commit_time if 'commit_time' in wanted else None,
+                commit.message if 'message' in wanted else None)
+        return self._call(commit)
+
+    def manifest(self, rev):
+        """return the full file manifest of a commit"""
+        return self._call(lambda repo: dict(repo[rev].manifest))
+
+    def entries(self, rev, path=''):
+        """return the entries of one directory of a commit's tree
+
+        Throws a KeyError, as Tree.lookup does, if there's no directory at
+        path.
+        """
+        def entries(repo):
+            tree = repo[rev].tree
+            directory = path.strip('/')
+            if directory:
+                entry = tree.lookup(directory)
+                if not entry.is_directory:
+                    raise KeyError(path)
+                children = entry.children
+            else:
+                children = tree.entries
+            # Directory entries can carry lazily loaded children; copy them
+            # out bare
+            return dict((name, TreeEntry(child.name, child.sha, child.mode))
+                        for name, child in children.iteritems())
+        return self._call(entries)
+
+    def diff(self, old, new, **kwargs):
+        """diff the trees of two commits; old may be None
+
+        Keyword arguments are passed on to Tree.diff.
+        """
+        def diff(repo):
+            old_tree = repo[old].tree if old is not None else None
+            return repo[new].tree.diff(old_tree, **kwargs)
+        return self._call(diff)
+
+    def changed_files(self, rev):
+        """return the changes a commit made relative to its parents"""
+        return self._call(lambda repo: repo[rev].changed_files())
+
+    def blob(self, sha):
+        """return the full contents of a blob"""
+        return self._call(lambda repo: repo.blob(sha).data)
+
+    def blob_chunks(self, sha, chunk_size=65536):
+        """return an AsyncIterator over a blob's contents, one chunk per batch
+
+        Only one chunk is held in memory at a time.
+        """
+        state = {}
+
+        def produce(repo):
+            if 'reader' not in state:
+                state['reader'] = repo.blob(sha).open()
+            chunk = state['reader'].read(chunk_size)
+            if not chunk:
+                state['reader'].close()
+                return []
+            return [chunk]
+        return AsyncIterator(self, produce)
+
+    def walk(self, include=[], exclude=[], limit=None, sort='topological', batch=256):
+        """return an AsyncIterator over the Oids of a walk
+
+        Arguments are as for Walker.open.  Oids are fetched from the
+        repository's thread batch Oids at a time.
+        """
+        state = {}
+
+        def produce(repo):
+            if 'walker' not in state:
+                state['walker'] = Walker(repo)
+                state['walker'].open(include=include, exclude=exclude, limit=limit, sort=sort)
+            oids = state['walker'].next_batch(batch)
+            if not oids:
+                state['walker'].close()
+            return oids
+        return AsyncIterator(self, produce)
+
+    def _call(self, fn, *args, **kwargs):
+        def call():
+            return fn(self._open(), *args, **kwargs)
+        return self._submit(call)
+
+    def _submit(self, fn):
+        import trollius
+        return trollius.get_event_loop().run_in_executor(self._thread, fn)
+
+    def _open(self):
+        # Only ever called on this repository's thread
+        if self._repo is None:
+            self._repo = Repo(self._path, **self._repo_kwargs)
+        self._repo.open()
+        return self._repo
+
+    def _close(self):
+        if self._repo is not None:
+            self._repo.close()
+
+
+class AsyncIterator(object):
+    """an iterator fed in batches from an AsyncRepo's thread
+
+    Trollius has no async for, so iterate with
+
+        while True:
+            batch = yield From(it.next_batch())
+            if not batch:
+                break
+
+    produce is called with the Repo on the repository's thread and returns
+    a list of items, or an empty list once it's exhausted.
+    """
+
+    def __init__(self, repo, produce):
+        self._repo = repo
+        self._produce = produce
+
+    def next_batch(self):
+        """return a future for the next batch of items; empty when exhausted"""
+        return self._repo._call(self._produce)
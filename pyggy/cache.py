@@ -0,0 +1,251 @@
+from collections import OrderedDict
+import cPickle as pickle
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+
+class LRUCache(object):
+    """a bounded, least-recently-used object cache
+
+    Entries are evicted once either max_entries or max_bytes is exceeded.
+    Because pyggy objects don't know their own memory footprint, sizes are
+    estimated by the sizeof callable handed in at construction time; the
+    default simply counts every entry as one byte, which makes max_bytes
+    behave like max_entries.
+
+    Either bound may be None, in which case it is not enforced.  A cache
+    with neither bound behaves like the plain dicts pyggy used to use.
+
+    Anything implementing get, __contains__, __getitem__, __setitem__,
+    update, and clear can be handed to Repo in place of an LRUCache.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=None):
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._sizeof = sizeof or (lambda value: 1)
+        self._lock = threading.RLock()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(self._entries.keys())
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            size = self._sizeof(value)
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.bytes += size
+            self._enforce()
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self._entries:
+                raise KeyError(key)
+            self._discard(key)
+
+    def get(self, key, default=None):
+        """return the cached value for key, marking it recently used"""
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def update(self, other):
+        for key, value in other.items():
+            self[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def resize(self, max_entries=None, max_bytes=None):
+        """change the bounds of this cache, evicting immediately if needed"""
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self._enforce()
+
+    @property
+    def stats(self):
+        """a dict of the current counters for this cache"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _discard(self, key):
+        del self._entries[key]
+        self.bytes -= self._sizes.pop(key)
+
+    def _enforce(self):
+        while self._entries and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries) or
+                (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            key = next(iter(self._entries))
+            self._discard(key)
+            self.evictions += 1
+
+
+class DiskCache(object):
+    """a pickle-backed cache of immutable results in a directory on disk
+
+    Each entry lives in its own file, named after a hash of its key, and is
+    written atomically, so several processes may safely share a directory.
+    Keys must have a stable repr, such as tuples of strings and numbers.
+    Entries are never invalidated or evicted; this is only suitable for
+    results that are a pure function of their key.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return os.path.exists(self._filename(key))
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        filename = self._filename(key)
+        directory = os.path.dirname(filename)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, temp = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp, filename)
+        except:
+            os.unlink(temp)
+            raise
+
+    def get(self, key, default=None):
+        try:
+            with open(self._filename(key), 'rb') as f:
+                value = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def update(self, other):
+        for key, value in other.items():
+            self[key] = value
+
+    def clear(self):
+        """remove every entry this cache has written to its directory"""
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            if len(name) == 2:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def _filename(self, key):
+        digest = hashlib.sha1(repr(key)).hexdigest()
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+
+class TieredCache(object):
+    """a fast cache layered over a slower, shared one
+
+    Reads check the first cache, then the second, promoting anything found
+    there; writes go to both.  Typically an LRUCache over a DiskCache.
+    """
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+
+    def __contains__(self, key):
+        return key in self.first or key in self.second
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.first[key] = value
+        self.second[key] = value
+
+    def get(self, key, default=None):
+        value = self.first.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.second.get(key, _MISSING)
+            if value is _MISSING:
+                return default
+            self.first[key] = value
+        return value
+
+    def update(self, other):
+        for key, value in other.items():
+            self[key] = value
+
+    def clear(self):
+        self.first.clear()
+        self.second.clear()
+
+    def resize(self, max_entries=None, max_bytes=None):
+        if hasattr(self.first, 'resize'):
+            self.first.resize(max_entries, max_bytes)
+
+    @property
+    def stats(self):
+        return {
+            'first': getattr(self.first, 'stats', None),
+            'second': getattr(self.second, 'stats', None),
+        }
+
+_MISSING = object()
@@ -21,12 +21,14 @@ defs = '\n'.join([
     headers.signature,
     headers.index,
     headers.odb,
+    headers.odb_backend,
     headers.repository,
     headers.revwalk,
     headers.diff,
     headers.merge,
     headers.graph,
     headers.refs,
+    headers.refdb,
     headers.reflog,
     headers.revparse,
     headers.object,
@@ -51,6 +53,7 @@ defs = '\n'.join([
     headers.reset,
     headers.message,
     headers.pack,
+    headers.indexer,
     headers.stash,
 ])
 ffi.cdef(defs)
@@ -66,7 +69,14 @@ if __libraries:
 if __module:
     __args['modulename'] = __module
 
-lib = ffi.verify("#include <git2.h>",
+# Custom backends need the struct definitions from git2/sys, which git2.h
+# leaves out
+lib = ffi.verify("""
+#include <git2.h>
+#include <git2/sys/odb_backend.h>
+#include <git2/sys/refdb_backend.h>
+#include <git2/sys/refs.h>
+""",
                  libraries=['git2'],
                  ext_package='pyggy',
                  **__args)
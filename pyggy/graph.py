@@ -0,0 +1,399 @@
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+import weakref
+
+from .core import lib, ffi
+from . import error, util
+
+_MAGIC = 'PGCG'
+_VERSION = 1
+_HEADER = struct.Struct('=4sIII')
+_U32 = struct.Struct('=I')
+_TWO_U32 = struct.Struct('=II')
+_TIME = struct.Struct('=q')
+_RAWSZ = 20
+
+_ONE = 1
+_TWO = 2
+_BOTH = _ONE | _TWO
+_STALE = 4
+
+
+class CommitGraph(object):
+    """a memory-mapped index of the commit graph, for fast ancestry queries
+
+    The graph stores, for every indexed commit, its parents (as indexes
+    into the graph), its commit time, and its generation number (one more
+    than the largest generation of its parents, with roots at 1).  Since a
+    commit's generation is always larger than any of its ancestors',
+    ancestry walks can stop as soon as they drop below the generation of
+    the commit they're looking for, and merge-base and ahead/behind
+    queries can process commits strictly children-first without parsing
+    anything from the ODB.
+
+    Commits are appended in topological order and never removed.  Queries
+    on commits that aren't indexed yet index them (and their ancestors) in
+    memory; update() indexes new history and writes it out, and
+    Repo.commit_graph calls it for you whenever branches have moved.  The file on disk is replaced atomically, so several processes
+    can share it.  The format is a host-local cache, not Git's own
+    commit-graph format.
+
+    You will usually get one of these from Repo.commit_graph.
+    """
+
+    def __init__(self, repo, path):
+        self._repo = weakref.ref(repo)
+        self.path = path
+        self._file = None
+        self._map = None
+        self._count = 0
+        self._edge_count = 0
+        self._tail = []
+        self._tail_index = {}
+        self._load()
+
+    def __len__(self):
+        return self._count + len(self._tail)
+
+    def __contains__(self, oid):
+        return self._index(self._repo().oid(oid).raw) is not None
+
+    def close(self):
+        """unmap the graph file, discarding anything that hasn't been flushed"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._count = self._edge_count = 0
+        self._tail = []
+        self._tail_index = {}
+
+    def update(self, include=None, flush=True):
+        """index every commit reachable from include that isn't indexed yet
+
+        include defaults to all branches.  Only new commits are read from
+        the ODB.  Unless flush is False, the graph is written back to disk
+        afterwards if anything was added.
+        """
+        repo = self._repo()
+        if include is None:
+            include = repo.branches.values()
+        loaded = {}
+        stack = [repo.oid(str(sha)).raw for sha in include]
+        while stack:
+            raw = stack[-1]
+            if self._index(raw) is not None:
+                stack.pop()
+                continue
+            if raw not in loaded:
+                loaded[raw] = self._read_commit(raw)
+            time, parents = loaded[raw]
+            missing = [parent for parent in parents if self._index(parent) is None]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            indexes = [self._index(parent) for parent in parents]
+            generation = 1 + max([self._generation(idx) for idx in indexes] or [0])
+            self._tail_index[raw] = self._count + len(self._tail)
+            self._tail.append((raw, time, generation, indexes))
+            del loaded[raw]
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """write any commits indexed in memory out to disk
+
+        The sections already on disk are copied across whole; only the
+        commits indexed since the last flush are packed one by one.
+        """
+        if not self._tail:
+            return
+        old = self._count
+        count = len(self)
+        tail = self._tail
+        edges = []
+        starts = []
+        for raw, time, generation, parents in tail:
+            edges.extend(parents)
+            starts.append(self._edge_count + len(edges))
+        edge_count = self._edge_count + len(edges)
+
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, temp = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, _VERSION, count, edge_count))
+                f.write(self._section('_oids_offset', old * _RAWSZ))
+                f.write(''.join(entry[0] for entry in tail))
+                f.write(self._section('_times_offset', old * 8))
+                f.write(struct.pack('=%dq' % len(tail), *[entry[1] for entry in tail]))
+                f.write(self._section('_generations_offset', old * 4))
+                f.write(struct.pack('=%dI' % len(tail), *[entry[2] for entry in tail]))
+                f.write(self._section('_starts_offset', (old + 1) * 4) if old else _U32.pack(0))
+                f.write(struct.pack('=%dI' % len(starts), *starts))
+                f.write(self._section('_edges_offset', self._edge_count * 4))
+                f.write(struct.pack('=%dI' % len(edges), *edges))
+                self._write_lookup(f)
+            os.rename(temp, self.path)
+        except:
+            os.unlink(temp)
+            raise
+        self.close()
+        self._load()
+
+    def is_ancestor(self, ancestor, descendant):
+        """check whether ancestor is reachable from (or equal to) descendant"""
+        target = self._require(ancestor)
+        start = self._require(descendant)
+        if target == start:
+            return True
+        floor = self._generation(target)
+        if self._generation(start) <= floor:
+            return False
+        seen = set([start])
+        stack = [start]
+        while stack:
+            for parent in self._parents(stack.pop()):
+                if parent == target:
+                    return True
+                # Anything at or below the target's generation can't reach it
+                if parent not in seen and self._generation(parent) > floor:
+                    seen.add(parent)
+                    stack.append(parent)
+        return False
+
+    def merge_bases(self, one, two):
+        """return the Oids of the best common ancestors of two commits"""
+        first = self._require(one)
+        second = self._require(two)
+        repo = self._repo()
+        if first == second:
+            return [repo._intern(self._raw(first))]
+        queue = _PaintQueue(self, lambda flags: flags & _STALE)
+        queue.paint(first, _ONE)
+        queue.paint(second, _TWO)
+        bases = []
+        while queue.active:
+            idx, flags = queue.pop()
+            if flags == _BOTH:
+                # Everything below a merge base is a worse merge base
+                bases.append(idx)
+                flags |= _STALE
+            for parent in self._parents(idx):
+                queue.paint(parent, flags)
+        return [repo._intern(self._raw(base)) for base in bases]
+
+    def merge_base(self, one, two):
+        """return the Oid of a best common ancestor of two commits, or None"""
+        bases = self.merge_bases(one, two)
+        return bases[0] if bases else None
+
+    def ahead_behind(self, local, upstream):
+        """return how many commits local is (ahead of, behind) upstream"""
+        first = self._require(local)
+        second = self._require(upstream)
+        queue = _PaintQueue(self, lambda flags: flags & _BOTH == _BOTH)
+        queue.paint(first, _ONE)
+        queue.paint(second, _TWO)
+        ahead = behind = 0
+        while queue.active:
+            idx, flags = queue.pop()
+            if flags == _ONE:
+                ahead += 1
+            elif flags == _TWO:
+                behind += 1
+            for parent in self._parents(idx):
+                queue.paint(parent, flags)
+        return ahead, behind
+
+    def generation(self, oid):
+        """return the generation number of a commit"""
+        return self._generation(self._require(oid))
+
+    def commit_time(self, oid):
+        """return the commit time of a commit, in seconds since the epoch"""
+        return self._time(self._require(oid))
+
+    def parents(self, oid):
+        """return the Oids of a commit's parents"""
+        repo = self._repo()
+        return [repo._intern(self._raw(idx)) for idx in self._parents(self._require(oid))]
+
+    def _load(self):
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            return
+        try:
+            size = os.fstat(f.fileno()).st_size
+            if size < _HEADER.size:
+                f.close()
+                return
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            f.close()
+            raise
+        magic, version, count, edge_count = _HEADER.unpack_from(mapped, 0)
+        expected = _HEADER.size + count * (_RAWSZ + 8 + 4 + 4 + 4) + 4 + edge_count * 4
+        if magic != _MAGIC or version != _VERSION or size != expected:
+            # Stale or corrupt; ignore it and let the next flush replace it
+            mapped.close()
+            f.close()
+            return
+        self._file = f
+        self._map = mapped
+        self._count = count
+        self._edge_count = edge_count
+        self._oids_offset = _HEADER.size
+        self._times_offset = self._oids_offset + count * _RAWSZ
+        self._generations_offset = self._times_offset + count * 8
+        self._starts_offset = self._generations_offset + count * 4
+        self._edges_offset = self._starts_offset + (count + 1) * 4
+        self._lookup_offset = self._edges_offset + edge_count * 4
+
+    def _read_commit(self, raw):
+        commit = ffi.new('git_commit **')
+        err = lib.git_commit_lookup(commit, self._repo().pointer, util.oid_from_raw(raw))
+        if err:
+            if err == lib.GIT_ENOTFOUND:
+                raise KeyError(util.hexlify(raw))
+            raise error.GitException
+        commit = commit[0]
+        try:
+            parents = [util.raw(lib.git_commit_parent_id(commit, idx))
+                       for idx in xrange(lib.git_commit_parentcount(commit))]
+            return lib.git_commit_time(commit), parents
+        finally:
+            lib.git_commit_free(commit)
+
+    def _require(self, oid):
+        raw = self._repo().oid(oid).raw
+        idx = self._index(raw)
+        if idx is None:
+            self.update([oid], flush=False)
+            idx = self._index(raw)
+        return idx
+
+    def _index(self, raw):
+        idx = self._tail_index.get(raw)
+        if idx is not None:
+            return idx
+        mapped = self._map
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            idx = _U32.unpack_from(mapped, self._lookup_offset + 4 * mid)[0]
+            candidate = self._raw(idx)
+            if candidate < raw:
+                lo = mid + 1
+            elif candidate > raw:
+                hi = mid
+            else:
+                return idx
+        return None
+
+    def _section(self, name, length):
+        # The first length bytes of a mapped section, by its offset attribute
+        if not length:
+            return ''
+        start = getattr(self, name)
+        return self._map[start:start + length]
+
+    def _write_lookup(self, f):
+        # Splice the new commits into the sorted lookup table on disk, a
+        # binary search each, copying the runs between them whole
+        new = sorted(xrange(self._count, len(self)), key=lambda idx: self._tail[idx - self._count][0])
+        copied = 0
+        for idx in new:
+            position = self._lookup_position(self._tail[idx - self._count][0])
+            if position > copied:
+                start = self._lookup_offset + 4 * copied
+                f.write(self._map[start:self._lookup_offset + 4 * position])
+                copied = position
+            f.write(_U32.pack(idx))
+        if copied < self._count:
+            f.write(self._map[self._lookup_offset + 4 * copied:self._lookup_offset + 4 * self._count])
+
+    def _lookup_position(self, raw):
+        # Where raw sorts among the commits on disk
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            idx = _U32.unpack_from(self._map, self._lookup_offset + 4 * mid)[0]
+            if self._raw(idx) < raw:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _raw(self, idx):
+        if idx >= self._count:
+            return self._tail[idx - self._count][0]
+        offset = self._oids_offset + idx * _RAWSZ
+        return self._map[offset:offset + _RAWSZ]
+
+    def _time(self, idx):
+        if idx >= self._count:
+            return self._tail[idx - self._count][1]
+        return _TIME.unpack_from(self._map, self._times_offset + idx * 8)[0]
+
+    def _generation(self, idx):
+        if idx >= self._count:
+            return self._tail[idx - self._count][2]
+        return _U32.unpack_from(self._map, self._generations_offset + idx * 4)[0]
+
+    def _parents(self, idx):
+        if idx >= self._count:
+            return self._tail[idx - self._count][3]
+        start, end = _TWO_U32.unpack_from(self._map, self._starts_offset + idx * 4)
+        if start == end:
+            return ()
+        return struct.unpack_from('=%dI' % (end - start), self._map, self._edges_offset + start * 4)
+
+
+class _PaintQueue(object):
+    """a children-first queue of painted commits
+
+    Commits pop in decreasing generation order, so by the time a commit
+    pops, every descendant that could paint it already has.  active counts
+    the queued commits that are not yet settled, per the settled predicate.
+    """
+
+    def __init__(self, graph, settled):
+        self._graph = graph
+        self._settled = settled
+        self._heap = []
+        self._queued = set()
+        self.flags = {}
+        self.active = 0
+
+    def paint(self, idx, flags):
+        old = self.flags.get(idx, 0)
+        new = old | flags
+        if new == old:
+            return
+        self.flags[idx] = new
+        if idx in self._queued:
+            if self._settled(new) and not self._settled(old):
+                self.active -= 1
+        else:
+            self._queued.add(idx)
+            heapq.heappush(self._heap, (-self._graph._generation(idx), idx))
+            if not self._settled(new):
+                self.active += 1
+
+    def pop(self):
+        idx = heapq.heappop(self._heap)[1]
+        self._queued.discard(idx)
+        flags = self.flags[idx]
+        if not self._settled(flags):
+            self.active -= 1
+        return idx, flags
@@ -1,10 +1,29 @@
 int git_odb_backend_pack(git_odb_backend **out, const char *objects_dir);
 int git_odb_backend_loose(git_odb_backend **out, const char *objects_dir, int compression_level, int do_fsync);
 int git_odb_backend_one_pack(git_odb_backend **out, const char *index_file);
+#define GIT_ODB_BACKEND_VERSION ...
+struct git_odb_backend {
+	unsigned int version;
+	git_odb *odb;
+
+	int (*read)(void **, size_t *, git_otype *, git_odb_backend *, const git_oid *);
+	int (*read_prefix)(git_oid *, void **, size_t *, git_otype *, git_odb_backend *, const git_oid *, size_t);
+	int (*read_header)(size_t *, git_otype *, git_odb_backend *, const git_oid *);
+	int (*write)(git_oid *, git_odb_backend *, const void *, size_t, git_otype);
+	int (*writestream)(git_odb_stream **, git_odb_backend *, size_t, git_otype);
+	int (*readstream)(git_odb_stream **, git_odb_backend *, const git_oid *);
+	int (*exists)(git_odb_backend *, const git_oid *);
+	int (*refresh)(git_odb_backend *);
+	int (*foreach)(git_odb_backend *, git_odb_foreach_cb cb, void *payload);
+	int (*writepack)(git_odb_writepack **, git_odb_backend *, git_transfer_progress_callback progress_cb, void *progress_payload);
+	void (*free)(git_odb_backend *);
+	...;
+};
+void * git_odb_backend_malloc(git_odb_backend *backend, size_t len);
 typedef enum {
-	GIT_STREAM_RDONLY = (1 << 1),
-	GIT_STREAM_WRONLY = (1 << 2),
-	GIT_STREAM_RW = (GIT_STREAM_RDONLY | GIT_STREAM_WRONLY),
+	GIT_STREAM_RDONLY = ...,
+	GIT_STREAM_WRONLY = ...,
+	GIT_STREAM_RW = ...,
 } git_odb_stream_t;
 struct git_odb_stream {
 	git_odb_backend *backend;
@@ -2,3 +2,26 @@ int git_refdb_new(git_refdb **out, git_repository *repo);
 int git_refdb_open(git_refdb **out, git_repository *repo);
 int git_refdb_compress(git_refdb *refdb);
 void git_refdb_free(git_refdb *refdb);
+#define GIT_REFDB_BACKEND_VERSION ...
+struct git_reference_iterator {
+	git_refdb *db;
+	int (*next)(git_reference **ref, git_reference_iterator *iter);
+	int (*next_name)(const char **ref_name, git_reference_iterator *iter);
+	void (*free)(git_reference_iterator *iter);
+	...;
+};
+struct git_refdb_backend {
+	unsigned int version;
+	int (*exists)(int *exists, git_refdb_backend *backend, const char *ref_name);
+	int (*lookup)(git_reference **out, git_refdb_backend *backend, const char *ref_name);
+	int (*iterator)(git_reference_iterator **iter, git_refdb_backend *backend, const char *glob);
+	int (*write)(git_refdb_backend *backend, const git_reference *ref, int force);
+	int (*rename)(git_reference **out, git_refdb_backend *backend, const char *old_name, const char *new_name, int force);
+	int (*delete)(git_refdb_backend *backend, const char *ref_name);
+	int (*compress)(git_refdb_backend *backend);
+	void (*free)(git_refdb_backend *backend);
+	...;
+};
+int git_refdb_set_backend(git_refdb *refdb, git_refdb_backend *backend);
+git_reference * git_reference__alloc(const char *name, const git_oid *oid, const git_oid *peel);
+git_reference * git_reference__alloc_symbolic(const char *name, const char *target);
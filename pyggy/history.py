@@ -0,0 +1,220 @@
+import heapq
+import itertools
+import weakref
+
+from .core import lib, ffi
+from . import error, util
+
+
+class PathHistory(object):
+    """walks the commits that changed a set of paths
+
+    This is the equivalent of git log -- <paths>, including git's default
+    history simplification: a merge that is identical to one of its parents
+    on the given paths is skipped, and only that parent's history is
+    followed.  Commits are compared by the ids of the entries at each path,
+    so unchanged subtrees are never descended into.
+
+    Commits come out newest first, by commit time.  You will usually want
+    Repo.history rather than creating these directly.
+    """
+
+    def __init__(self, repo, paths, include=[], exclude=[], limit=None):
+        self._repo = weakref.ref(repo)
+        if isinstance(paths, basestring):
+            paths = [paths]
+        self._paths = [path.strip('/') for path in paths]
+        self._include = include
+        self._exclude = exclude
+        self._limit = limit
+        self._commits = {}
+        self._path_ids = {}
+
+    def __iter__(self):
+        repo = self._repo()
+        include = self._include or repo.branches.values()
+        remaining = self._limit
+
+        heap = []
+        counter = itertools.count()
+        uninteresting = {}
+        pending = set()
+        state = {'interesting': 0}
+
+        def push(oid, hidden):
+            if oid in uninteresting:
+                if hidden and not uninteresting[oid]:
+                    uninteresting[oid] = True
+                    if oid in pending:
+                        state['interesting'] -= 1
+                return
+            uninteresting[oid] = hidden
+            pending.add(oid)
+            if not hidden:
+                state['interesting'] += 1
+            # heapq is a min-heap, so negate times to get newest first
+            heapq.heappush(heap, (-self._commit(oid)[0], next(counter), oid))
+
+        for sha in include:
+            push(repo.oid(str(sha)), False)
+        for sha in self._exclude:
+            push(repo.oid(str(sha)), True)
+
+        while heap and state['interesting'] and remaining != 0:
+            oid = heapq.heappop(heap)[2]
+            pending.discard(oid)
+            time, tree, parents = self._commit(oid)
+            if uninteresting[oid]:
+                for parent in parents:
+                    push(parent, True)
+                continue
+            state['interesting'] -= 1
+
+            ids = self._ids(tree)
+            if not parents:
+                if any(ids):
+                    if remaining is not None:
+                        remaining -= 1
+                    yield oid
+                continue
+
+            same = None
+            for parent in parents:
+                if self._ids(self._commit(parent)[1]) == ids:
+                    same = parent
+                    break
+            if same is not None:
+                push(same, False)
+            else:
+                if remaining is not None:
+                    remaining -= 1
+                yield oid
+                for parent in parents:
+                    push(parent, False)
+
+    def _commit(self, oid):
+        """return (time, tree oid, parent oids) for a commit"""
+        info = self._commits.get(oid)
+        if info is not None:
+            return info
+        repo = self._repo()
+        commit = ffi.new('git_commit **')
+        err = lib.git_commit_lookup(commit, repo.pointer, oid.pointer)
+        if err:
+            if err == lib.GIT_ENOTFOUND:
+                raise KeyError(oid.sha)
+            raise error.GitException
+        commit = commit[0]
+        try:
+            parents = [repo.oid(lib.git_commit_parent_id(commit, idx))
+                       for idx in xrange(lib.git_commit_parentcount(commit))]
+            info = (lib.git_commit_time(commit), repo.oid(lib.git_commit_tree_id(commit)), parents)
+        finally:
+            lib.git_commit_free(commit)
+        self._commits[oid] = info
+        return info
+
+    def _ids(self, tree_oid):
+        """return the raw entry ids at each path for a tree, or None where absent"""
+        ids = self._path_ids.get(tree_oid)
+        if ids is not None:
+            return ids
+        tree = ffi.new('git_tree **')
+        if lib.git_tree_lookup(tree, self._repo().pointer, tree_oid.pointer):
+            raise error.GitException
+        tree = tree[0]
+        ids = []
+        try:
+            entry = ffi.new('git_tree_entry **')
+            for path in self._paths:
+                if not path:
+                    ids.append(tree_oid.raw)
+                    continue
+                err = lib.git_tree_entry_bypath(entry, tree, path)
+                if err:
+                    if err != lib.GIT_ENOTFOUND:
+                        raise error.GitException
+                    ids.append(None)
+                    continue
+                ids.append(util.raw(lib.git_tree_entry_id(entry[0])))
+                lib.git_tree_entry_free(entry[0])
+        finally:
+            lib.git_tree_free(tree)
+        ids = tuple(ids)
+        self._path_ids[tree_oid] = ids
+        return ids
+
+
+def last_modified(repo, oid, path=''):
+    """find the last commit to modify each entry of a directory
+
+    Returns a dict mapping each entry name in the directory at path (as of
+    the commit oid) to the Oid of the commit that introduced its current
+    version.  All entries are resolved in a single walk over the commits
+    that touched the directory, which stops as soon as every entry has
+    been accounted for.  You will usually want Commit.last_modified
+    instead.
+    """
+    path = path.strip('/')
+    oid = repo.oid(oid)
+    history = PathHistory(repo, [path], include=[oid])
+    listings = {}
+
+    def listing(tree_oid):
+        if tree_oid not in listings:
+            listings[tree_oid] = _directory_ids(repo, tree_oid, path)
+        return listings[tree_oid]
+
+    targets = listing(history._commit(oid)[1])
+    if not targets:
+        # No such directory (or it's a file); don't walk all of history
+        return {}
+    resolved = {}
+    for commit in history:
+        time, tree, parents = history._commit(commit)
+        ids = listing(tree)
+        parent_ids = [listing(history._commit(parent)[1]) for parent in parents]
+        for name, target in targets.iteritems():
+            if name in resolved or ids.get(name) != target:
+                continue
+            if all(p.get(name) != target for p in parent_ids):
+                resolved[name] = commit
+        if len(resolved) == len(targets):
+            break
+    return resolved
+
+
+def _directory_ids(repo, tree_oid, path):
+    """return a dict of entry name to raw id for the directory at path"""
+    tree = ffi.new('git_tree **')
+    if lib.git_tree_lookup(tree, repo.pointer, tree_oid.pointer):
+        raise error.GitException
+    tree = tree[0]
+    try:
+        if path:
+            entry = ffi.new('git_tree_entry **')
+            err = lib.git_tree_entry_bypath(entry, tree, path)
+            if err:
+                if err == lib.GIT_ENOTFOUND:
+                    return {}
+                raise error.GitException
+            entry = entry[0]
+            is_tree = lib.git_tree_entry_type(entry) == lib.GIT_OBJ_TREE
+            subtree_oid = util.oid_from_raw(util.raw(lib.git_tree_entry_id(entry)))
+            lib.git_tree_entry_free(entry)
+            if not is_tree:
+                return {}
+            lib.git_tree_free(tree)
+            tree = ffi.new('git_tree **')
+            if lib.git_tree_lookup(tree, repo.pointer, subtree_oid):
+                tree = None
+                raise error.GitException
+            tree = tree[0]
+        ids = {}
+        for idx in xrange(lib.git_tree_entrycount(tree)):
+            entry = lib.git_tree_entry_byindex(tree, idx)
+            ids[ffi.string(lib.git_tree_entry_name(entry))] = util.raw(lib.git_tree_entry_id(entry))
+        return ids
+    finally:
+        if tree is not None:
+            lib.git_tree_free(tree)
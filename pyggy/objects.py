@@ -1,7 +1,11 @@
 from collections import defaultdict, namedtuple, MutableMapping
+from multiprocessing.pool import ThreadPool
+import io
+import threading
 import weakref
 
 from .core import lib, ffi
+from .history import last_modified
 from . import error, util
 
 
@@ -27,28 +31,107 @@ def Oid(sha):
 
 
 class _Oid(object):
+    """a Git object ID, stored as its raw 20 bytes
+
+    The hex SHA and the C git_oid pointer are only produced when someone
+    actually asks for them, so Oids are cheap to create, hash, and compare
+    in bulk.  Oids built from abbreviated SHAs remember how many hex digits
+    they were given so that prefix lookups keep working.
+    """
+
+    __slots__ = ('raw', '_len', '_sha', '_oid', '__weakref__')
+
     def __init__(self, sha):
+        self._oid = None
         if isinstance(sha, basestring):
-            self._sha = str(sha)
-            self._oid = util.oid(self._sha)
+            self._sha = sha = str(sha)
+            self._len = len(sha)
+            self.raw = util.raw_from_sha(sha)
         else:
-            self._sha = util.sha(sha)
-            self._oid = sha
+            self._sha = None
+            self._len = lib.GIT_OID_HEXSZ
+            self.raw = util.raw(sha)
+
+    @classmethod
+    def from_raw(cls, raw):
+        """build an Oid directly from its 20 raw bytes"""
+        oid = cls.__new__(cls)
+        oid.raw = raw
+        oid._len = lib.GIT_OID_HEXSZ
+        oid._sha = None
+        oid._oid = None
+        return oid
 
     @property
     def sha(self):
+        if self._sha is None:
+            self._sha = util.hexlify(self.raw)[:self._len]
         return self._sha
 
     @property
     def pointer(self):
+        if self._oid is None:
+            self._oid = util.oid_from_raw(self.raw)
         return self._oid
 
     def __len__(self):
-        return len(self.sha)
+        return self._len
 
     def __str__(self):
         return self.sha
 
+    def __repr__(self):
+        return 'Oid(%r)' % self.sha
+
+    def __hash__(self):
+        return hash(self.raw)
+
+    def __eq__(self, other):
+        if not isinstance(other, _Oid):
+            return NotImplemented
+        return self.raw == other.raw and self._len == other._len
+
+    def __ne__(self, other):
+        if not isinstance(other, _Oid):
+            return NotImplemented
+        return self.raw != other.raw or self._len != other._len
+
+    def __lt__(self, other):
+        if not isinstance(other, _Oid):
+            return NotImplemented
+        return self.raw < other.raw
+
+    def __le__(self, other):
+        if not isinstance(other, _Oid):
+            return NotImplemented
+        return self.raw <= other.raw
+
+    def __gt__(self, other):
+        if not isinstance(other, _Oid):
+            return NotImplemented
+        return self.raw > other.raw
+
+    def __ge__(self, other):
+        if not isinstance(other, _Oid):
+            return NotImplemented
+        return self.raw >= other.raw
+
+
+class ObjectHeader(namedtuple('ObjectHeader', ('type', 'size'))):
+    """the type name and inflated size of an object in the ODB"""
+
+
+class MergeResult(namedtuple('MergeResult', ('base', 'conflicts'))):
+    """represents the outcome of an in-memory merge
+
+    base is the Oid of the merge base used (None for unrelated histories),
+    and conflicts is a sorted list of the paths that did not merge cleanly.
+    """
+
+    @property
+    def clean(self):
+        return not self.conflicts
+
 
 class Timestamp(object):
     """represents a git timestamp"""
@@ -60,6 +143,12 @@ class Timestamp(object):
         return 'Timestamp(%r, %r)' % (self.seconds, self.offset)
 
 
+def _signature_line(user):
+    offset = user.when.offset / 60
+    return '%s <%s> %d %s%02d%02d' % (user.name.strip(), user.email.strip(), user.when.seconds,
+                                      '-' if offset < 0 else '+', abs(offset) / 60, abs(offset) % 60)
+
+
 class User(object):
     """represents a parsed Git user"""
     def __init__(self, name, email, when):
@@ -124,16 +213,60 @@ class Blob(object):
         """
         if self.oid is not None:
             return
+        repo = self._repo()
+        if repo._transaction is not None:
+            self.oid = repo._transaction.add(lib.GIT_OBJ_BLOB, self.data)
+            return
         oid = ffi.new('git_oid *')
-        if lib.git_blob_create_frombuffer(oid, self._repo().pointer, self.data, self._size):
+        if lib.git_blob_create_frombuffer(oid, repo.pointer, self.data, self._size):
             raise error.GitException
         self.oid = Oid(oid)
 
+    def open(self):
+        """return a read-only, file-like object over this blob's contents
+
+        Data is copied out of libgit2 only as you read it, so pair this with
+        something like shutil.copyfileobj to stream a large blob in chunks
+        of bounded size.
+        """
+        if self._data is not None or not self.oid:
+            return io.BytesIO(self._data or '')
+        return BlobReader(self._content())
+
+    def view(self):
+        """return a zero-copy memoryview of this blob's contents
+
+        The underlying libgit2 blob stays alive for as long as the view (or
+        anything sliced from it) does.  As with all pyggy objects, the view
+        must not outlive the Repo it came from.
+
+        For blobs read from the ODB the view points straight into libgit2's
+        cached copy of the blob, and Python can't make it read-only.  Never
+        write to it: doing so silently corrupts that blob for every other
+        reader of this repository.  Copy it with tobytes() if you need to
+        modify the data.
+        """
+        if self._data is not None or not self.oid:
+            return memoryview(self._data or '')
+        return memoryview(self._content())
+
+    def _content(self):
+        blob = ffi.new('git_blob **')
+        if lib.git_blob_lookup(blob, self._repo().pointer, self.oid.pointer):
+            raise error.GitException
+        blob = blob[0]
+        self._size = lib.git_blob_rawsize(blob)
+        # Tie the blob's lifetime to its content pointer, which any buffer
+        # over it will keep alive
+        content = ffi.gc(lib.git_blob_rawcontent(blob), lambda content: lib.git_blob_free(blob))
+        return ffi.buffer(content, self._size)
+
     @property
     def data(self):
         """the data backing this blob
 
-        Note that the *entire* blob will be read into memory.
+        Note that the *entire* blob will be read into memory.  Use open() or
+        view() if you want to avoid that.
         """
         if self._data is None:
             self.read()
@@ -154,17 +287,67 @@ class Blob(object):
         return self.oid.sha if self.oid else None
 
     def __len__(self):
-        """the size of this blob on-disk"""
+        """the size of this blob on-disk
+
+        Only the object header is read, so this does not inflate the blob.
+        """
         if self._size is None:
-            blob = ffi.new('git_blob **')
-            if lib.git_blob_lookup(blob, self._repo().pointer, self.oid.pointer):
-                raise error.GitException
-            blob = blob[0]
-            self._size = lib.git_blob_rawsize(blob)
-            lib.git_blob_free(blob)
+            self._size = self._repo().object_header(self.oid).size
         return self._size
 
 
+class BlobReader(io.RawIOBase):
+    """a seekable, read-only file over a blob's contents
+
+    You should get these from Blob.open() rather than creating them
+    directly.
+    """
+    def __init__(self, buf):
+        super(BlobReader, self).__init__()
+        self._buffer = buf
+        self._size = len(buf)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError('I/O operation on closed blob')
+        end = self._size if size is None or size < 0 else min(self._pos + size, self._size)
+        data = self._buffer[self._pos:end] if end > self._pos else ''
+        self._pos = max(self._pos, end)
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError('negative seek position %d' % offset)
+        self._pos = offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._buffer = None
+        super(BlobReader, self).close()
+
+
 class Raw(object):
     """represents a completely unparsed raw object from the ODB
 
@@ -174,21 +357,38 @@ class Raw(object):
         self._repo = weakref.ref(repo)
         self.oid = Oid(oid)
         self.data = None
+        self._header = None
 
     def read(self):
-        odb = ffi.new('git_odb **')
-        if lib.git_repository_odb(odb, self._repo().pointer):
+        odb_object = ffi.new('git_odb_object **')
+        if lib.git_odb_read(odb_object, self._repo().odb_pointer, self.oid.pointer):
             raise error.GitException
-        odb = odb[0]
-        try:
-            odb_object = ffi.new('git_odb_object **')
-            if lib.git_odb_read(odb_object, odb, self.oid.pointer):
-                raise error.GitException
-            odb_object = odb_object[0]
-            self.data = ffi.buffer(lib.git_odb_object_data(odb_object), lib.git_odb_object_size(odb_object))[:]
-            lib.git_odb_object_free(odb_object)
-        finally:
-            lib.git_odb_free(odb)
+        odb_object = odb_object[0]
+        size = lib.git_odb_object_size(odb_object)
+        self.data = ffi.buffer(lib.git_odb_object_data(odb_object), size)[:]
+        self._header = ObjectHeader(
+            ffi.string(lib.git_object_type2string(lib.git_odb_object_type(odb_object))), size)
+        lib.git_odb_object_free(odb_object)
+
+    @property
+    def type(self):
+        """the type name of this object, such as 'blob' or 'commit'
+
+        If the object hasn't been read, only its header is loaded.
+        """
+        if self._header is None:
+            self._header = self._repo().object_header(self.oid)
+        return self._header.type
+
+    @property
+    def size(self):
+        """the inflated size of this object
+
+        If the object hasn't been read, only its header is loaded.
+        """
+        if self._header is None:
+            self._header = self._repo().object_header(self.oid)
+        return self._header.size
 
 
 class Config(MutableMapping):
@@ -291,10 +491,18 @@ class Commit(object):
     reified them.  On the flip side, this means that, like all Pyggy
     objects, you cannot keep Commit objects around after you have
     called Repo.close.
+
+    Commits can also be partially loaded by passing a subset of
+    Commit.FIELDS to read().  Touching a field that wasn't loaded
+    loads everything that is still missing.
     """
+
+    FIELDS = frozenset(['author', 'committer', 'message', 'commit_time', 'parents', 'tree'])
+
     def __init__(self, repo, oid=None, load=True):
         self._repo = weakref.ref(repo)
         self.oid = Oid(oid) if oid else None
+        self._loaded = frozenset()
 
         self._author = None
         self._committer = None
@@ -309,49 +517,61 @@ class Commit(object):
             self.read()
 
     def __contains__(self, name):
-        self.read()
         return name in self.tree
 
     def __getitem__(self, name):
-        self.read()
         return self.tree[name]
 
-    def read(self):
+    def read(self, fields=None):
         """loads the actual commit data into this object
 
         You almost never need to call this method; the commit
         will load its data if it needs to when you access its
-        properties.
+        properties.  If fields is given, only those fields (out of
+        Commit.FIELDS) are loaded.
         """
 
         # Abort if we're not dirty or not a real commit
-        if self._tree is not None or self.oid is None:
+        if self.oid is None:
+            return
+        missing = (self.FIELDS if fields is None else frozenset(fields)) - self._loaded
+        if not missing:
             return
 
+        repo = self._repo()
         commit = ffi.new('git_commit **')
-        err = lib.git_commit_lookup_prefix(commit, self._repo().pointer,
-                                           self.oid.pointer, len(self.oid))
+        if len(self.oid) == lib.GIT_OID_HEXSZ:
+            err = lib.git_commit_lookup(commit, repo.pointer, self.oid.pointer)
+        else:
+            err = lib.git_commit_lookup_prefix(commit, repo.pointer,
+                                               self.oid.pointer, len(self.oid))
         if err:
             if err == lib.GIT_ENOTFOUND:
                 raise KeyError(self.oid.sha)
             raise error.GitException
         commit = commit[0]
 
-        self._author = User.from_signature(lib.git_commit_author(commit))
-        self._committer = User.from_signature(lib.git_commit_committer(commit))
-        self._message = ffi.string(lib.git_commit_message(commit))
-        encoding = lib.git_commit_message_encoding(commit)
-        self._message_encoding = ffi.string(encoding) if encoding != ffi.NULL else None
-        self._commit_time = lib.git_commit_time(commit)
-
-        self._parent_ids = []
-        for idx in xrange(lib.git_commit_parentcount(commit)):
-            self._parent_ids.append(Oid(lib.git_commit_parent_id(commit, idx)).sha)
-        self._parents = None
-
-        self._tree = Tree(self._repo(), lib.git_commit_tree_id(commit))
-
-        lib.git_commit_free(commit)
+        try:
+            if 'author' in missing:
+                self._author = User.from_signature(lib.git_commit_author(commit))
+            if 'committer' in missing:
+                self._committer = User.from_signature(lib.git_commit_committer(commit))
+            if 'message' in missing:
+                self._message = ffi.string(lib.git_commit_message(commit))
+                encoding = lib.git_commit_message_encoding(commit)
+                self._message_encoding = ffi.string(encoding) if encoding != ffi.NULL else None
+            if 'commit_time' in missing:
+                self._commit_time = lib.git_commit_time(commit)
+            if 'parents' in missing:
+                self._parent_ids = []
+                for idx in xrange(lib.git_commit_parentcount(commit)):
+                    self._parent_ids.append(util.sha(lib.git_commit_parent_id(commit, idx)))
+                self._parents = None
+            if 'tree' in missing:
+                self._tree = Tree(repo, repo.oid(lib.git_commit_tree_id(commit)), lazy=repo.lazy_trees)
+        finally:
+            lib.git_commit_free(commit)
+        self._loaded |= missing
 
     def write(self):
         """writes this commit to the ODB
@@ -361,6 +581,13 @@ class Commit(object):
         """
         if self.oid is not None:
             return
+        repo = self._repo()
+        if repo._transaction is not None:
+            if repo.contains_objects([self._tree.sha] + [str(p) for p in self._parent_ids]):
+                raise ValueError('commit tree and parents have not been properly serialized')
+            self.oid = repo._transaction.add(lib.GIT_OBJ_COMMIT, self._serialize())
+            self._loaded = self.FIELDS
+            return
         committer = self._committer.git_signature()
         author = self._author.git_signature() if self._author else self._committer.git_signature()
         encoding = self._message_encoding or 'UTF-8'
@@ -392,6 +619,7 @@ class Commit(object):
                                      parents):
                 raise error.GitException
             self.oid = Oid(oid)
+            self._loaded = self.FIELDS
         finally:
             if tree:
                 lib.git_tree_free(tree)
@@ -400,8 +628,17 @@ class Commit(object):
             for p in parents:
                 lib.git_commit_free(p)
 
+    def _serialize(self):
+        # The same layout git_commit_create writes
+        lines = ['tree %s' % self._tree.sha]
+        lines.extend('parent %s' % Oid(p).sha for p in self._parent_ids)
+        lines.append('author %s' % _signature_line(self._author or self._committer))
+        lines.append('committer %s' % _signature_line(self._committer))
+        lines.append('encoding %s' % (self._message_encoding or 'UTF-8'))
+        return '\n'.join(lines) + '\n\n' + self._message
+
     def changed_files(self, parent=None):
-        self.read()
+        self.read(('parents', 'tree'))
         if not self._parent_ids:
             return self._tree.diff(None)
         else:
@@ -410,53 +647,66 @@ class Commit(object):
                 d.update(self._tree.diff(parent._tree))
             return d
 
+    def last_modified(self, path=''):
+        """return the last commit to modify each entry of a directory
+
+        The result maps each entry name in the directory at path to the Oid
+        of the commit that last changed it, as of this commit.  Results are
+        cached per repository by commit and path.
+        """
+        repo = self._repo()
+        key = (self.sha, path.strip('/'))
+        result = repo._last_modified_cache.get(key)
+        if result is None:
+            result = repo._last_modified_cache[key] = last_modified(repo, self.oid, key[1])
+        return dict(result)
+
     @property
     def author(self):
         """return a User object representing this commit's author"""
-        self.read()
+        self._require('author')
         return self._author
 
     @author.setter
     def author(self, user):
-        self.oid = None
+        self._detach()
         self._author = user
 
     @property
     def committer(self):
         """return a User object representing this commit's committer"""
-        self.read()
+        self._require('committer')
         return self._committer
 
     @committer.setter
     def committer(self, user):
-        self.oid = None
+        self._detach()
         self._committer = user
 
     @property
     def manifest(self):
         """return the full file manifest"""
-        self.read()
         return self.tree.manifest
 
     @property
     def message(self):
         """return the lossy unicode representing this commit message"""
-        self.read()
+        self._require('message')
         return self._message
 
     @message.setter
     def message(self, message):
-        self.oid = None
+        self._detach()
         self._message = message
 
     @property
     def message_encoding(self):
-        self.read()
+        self._require('message')
         return self._message_encoding
 
     @message_encoding.setter
     def message_encoding(self, encoding):
-        self.oid = None
+        self._detach()
         self._message_encoding = encoding
 
     @property
@@ -466,7 +716,7 @@ class Commit(object):
         If you do not need full parent commit objects, consider using
         parent_ids instead.
         """
-        self.read()
+        self._require('parents')
         if self._parents is None:
             self._parents = [self._repo().commit(sha) for sha in self._parent_ids]
         return self._parents
@@ -478,13 +728,20 @@ class Commit(object):
         These are not full-fledge parent objects; you'll need to reify them
         using the appropriate repository if you want the full data, or you'll
         need to use the parents property instead."""
-        self.read()
+        self._require('parents')
         return self._parent_ids
 
     @parent_ids.setter
     def parent_ids(self, parent_ids):
-        self.oid = None
+        self._detach()
         self._parent_ids = parent_ids
+        self._parents = None
+
+    @property
+    def commit_time(self):
+        """return the commit time, in seconds since the epoch"""
+        self._require('commit_time')
+        return self._commit_time
 
     @property
     def sha(self):
@@ -503,17 +760,27 @@ class Commit(object):
         be loaded immediately, call .read() on the Tree you receive
         from this method immediately afterwards.
         """
-        self.read()
+        self._require('tree')
         return self._tree
 
     @tree.setter
     def tree(self, tree):
-        self.oid = None
+        self._detach()
         self._tree = tree
 
     def __repr__(self):
         return '<Commit(%s)>' % self.oid
 
+    def _require(self, field):
+        if field not in self._loaded:
+            self.read()
+
+    def _detach(self):
+        # Everything not yet read has to be pulled in while there's still
+        # an oid to read it from
+        self.read()
+        self.oid = None
+
 
 class ReferenceDb(MutableMapping):
     """manages a Git refstore
@@ -547,14 +814,18 @@ class ReferenceDb(MutableMapping):
             if lib.git_reference_resolve(ref, raw):
                 raise error.GitException
             resolved = ref[0]
-            target = Oid(lib.git_reference_target(resolved)).sha
+            target = util.sha(lib.git_reference_target(resolved))
             lib.git_reference_free(resolved)
             return target
         finally:
             lib.git_reference_free(raw)
 
     def __len__(self):
-        # Seriously, don't call this method; it's stupid, but required for collections.Mapping
+        refdb = self._repo().refdb
+        if refdb is not None:
+            return refdb.count(self._prefix)
+        # Seriously, don't call this method without a refdb; it's stupid, but
+        # required for collections.Mapping
         return len(list(iter(self)))
 
     # MutableMapping
@@ -567,6 +838,7 @@ class ReferenceDb(MutableMapping):
             raise error.GitException
         else:
             lib.git_reference_free(ref[0])
+        self._repo()._refs_changed()
 
     def __delitem__(self, name):
         assert name.startswith(self._prefix)
@@ -582,8 +854,46 @@ class ReferenceDb(MutableMapping):
                 raise error.GitException
         finally:
             lib.git_reference_free(ref)
+        self._repo()._refs_changed()
 
     # Auxiliary
+    def ahead_behind(self, base, threads=None):
+        """return a dict mapping each ref to how far it is (ahead, behind) base
+
+        By default, every ref is answered from the repository's CommitGraph,
+        so history is only parsed once no matter how many refs there are,
+        and refs pointing at the same commit share a single walk.  If
+        threads is given, the walks are instead spread across that many
+        threads, each with its own repository handle, using libgit2's
+        git_graph_ahead_behind.
+
+        base may be a SHA, ref, or tag.  Refs to annotated tags are
+        measured from the commits they point at; refs that don't lead to a
+        commit at all are left out.
+        """
+        repo = self._repo()
+        base = repo._resolve_rev(base)
+        refs = dict(self.iteritems())
+        # Only tags need peeling, and their SHAs would crowd the repo's
+        # resolved-rev cache, so look those up uncached
+        peeled = {}
+        for sha, header in repo.object_headers(set(refs.itervalues())).iteritems():
+            if header.type == 'commit':
+                peeled[sha] = sha
+            elif header.type == 'tag':
+                try:
+                    peeled[sha] = repo._lookup_rev(sha, lib.GIT_OBJ_COMMIT)
+                except KeyError:
+                    pass
+        refs = dict((name, peeled[sha]) for name, sha in refs.iteritems() if sha in peeled)
+        tips = set(refs.itervalues())
+        if threads:
+            counts = _parallel_ahead_behind(type(repo), repo.path, repo._worker_kwargs(), base, tips, threads)
+        else:
+            graph = repo.commit_graph
+            counts = dict((tip, graph.ahead_behind(tip, base)) for tip in tips)
+        return dict((name, counts[sha]) for name, sha in refs.iteritems())
+
     def iteritems(self):
         iterator = ffi.new('git_reference_iterator **')
         glob = self._prefix + '*'
@@ -602,7 +912,7 @@ class ReferenceDb(MutableMapping):
                 if lib.git_reference_resolve(ref, original):
                     raise error.GitException
                 resolved = ref[0]
-                target = Oid(lib.git_reference_target(resolved)).sha
+                target = util.sha(lib.git_reference_target(resolved))
 
                 yield name, target
                 lib.git_reference_free(resolved)
@@ -610,6 +920,35 @@ class ReferenceDb(MutableMapping):
             lib.git_reference_iterator_free(iterator)
 
 
+def _parallel_ahead_behind(repo_class, path, repo_kwargs, base, tips, threads):
+    base = Oid(str(base))
+    local = threading.local()
+    lock = threading.Lock()
+    handles = []
+
+    def count(tip):
+        repo = getattr(local, 'repo', None)
+        if repo is None:
+            repo = local.repo = repo_class(path, **repo_kwargs)
+            repo.open()
+            with lock:
+                handles.append(repo)
+        ahead = ffi.new('size_t *')
+        behind = ffi.new('size_t *')
+        if lib.git_graph_ahead_behind(ahead, behind, repo.pointer, Oid(tip).pointer, base.pointer):
+            raise error.GitException
+        return tip, (ahead[0], behind[0])
+
+    pool = ThreadPool(threads)
+    try:
+        return dict(pool.map(count, tips))
+    finally:
+        pool.close()
+        pool.join()
+        for repo in handles:
+            repo.close()
+
+
 class TreeEntry(namedtuple('TreeEntry', ('name', 'sha', 'mode'))):
     """represents an entry inside a Tree object"""
 
@@ -637,92 +976,256 @@ class TreeChange(namedtuple('TreeChange', ['new_path', 'old_path', 'old_sha', 'n
     COPIED = 'copied'
 
 
-class Tree(object):
-    """represents a Git tree object"""
-    def __init__(self, repo, oid=None):
+class _LazyChildren(MutableMapping):
+    """the children of a directory, loaded from the ODB on first access
+
+    Subdirectories get _LazyChildren of their own, so only the levels
+    someone actually looks at are ever read.
+    """
+    def __init__(self, repo, sha):
         self._repo = weakref.ref(repo)
-        self.oid = Oid(oid) if oid else None
-        self._entries = {}
-        self._manifest = {}
+        self._sha = sha
+        self._entries = None
 
-    def __contains__(self, name):
-        self.read()
-        return name in self._manifest
+    @property
+    def loaded(self):
+        return self._entries is not None
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+        repo = self._repo()
+        tree = ffi.new('git_tree **')
+        if lib.git_tree_lookup(tree, repo.pointer, Oid(self._sha).pointer):
+            raise error.GitException
+        tree = tree[0]
+        cache = repo._tree_cache
+        entries = {}
+        try:
+            for idx in xrange(lib.git_tree_entrycount(tree)):
+                entry = lib.git_tree_entry_byindex(tree, idx)
+                name = ffi.string(lib.git_tree_entry_name(entry))
+                mode = lib.git_tree_entry_filemode(entry)
+                sha = util.sha(lib.git_tree_entry_id(entry))
+                if mode & lib.GIT_FILEMODE_TREE:
+                    child = cache.get(sha)
+                    if child is None:
+                        child = TreeEntry(name, sha, mode)
+                        child.children = _LazyChildren(repo, sha)
+                        cache[sha] = child
+                    entries[name] = child
+                else:
+                    entries[name] = TreeEntry(name, sha, mode)
+        finally:
+            lib.git_tree_free(tree)
+        self._entries = entries
+        return entries
+
+    def viewitems(self):
+        return self._load().viewitems()
+
+    def viewkeys(self):
+        return self._load().viewkeys()
+
+    def viewvalues(self):
+        return self._load().viewvalues()
 
     def __getitem__(self, name):
-        self.read()
-        return Blob(self._repo(), self._manifest[name].sha)
+        return self._load()[name]
 
-    def diff(self, other, renames=False, hunks=False):
-        """calculate the diff across two trees
+    def __setitem__(self, name, entry):
+        self._load()[name] = entry
 
-        If you do not specify hunks, you will only get the files
-        changes.  If you do not specify renames, then no rename
-        tracking will be performed."""
-        self.read()
+    def __delitem__(self, name):
+        del self._load()[name]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+
+class RenameOptions(object):
+    """tunes rename and copy detection for Tree.diff and Tree.iterdiff
+
+    threshold is the similarity percentage (0-100) at which two files are
+    considered a rename or copy.  limit caps how many candidates libgit2
+    examines for inexact matches (0 means libgit2's default).  exact_only
+    restricts detection to files with identical contents, which is far
+    cheaper.  copies enables copy detection as well.
+
+    max_pairs bounds the work detection may do: if the number of
+    (added, deleted) candidate pairs exceeds it, detection is skipped,
+    changes are reported as plain adds and deletes, and the diff is
+    flagged as renames_truncated.
+    """
+    def __init__(self, threshold=50, limit=0, exact_only=False, copies=False, max_pairs=None):
+        self.threshold = threshold
+        self.limit = limit
+        self.exact_only = exact_only
+        self.copies = copies
+        self.max_pairs = max_pairs
+
+    @property
+    def key(self):
+        """a hashable summary of these options, for caching"""
+        return (self.threshold, self.limit, self.exact_only, self.copies, self.max_pairs)
+
+    def find_options(self):
+        """return a git_diff_find_options matching these settings"""
+        options = ffi.new('git_diff_find_options *')
+        options.version = lib.GIT_DIFF_FIND_OPTIONS_VERSION
+        options.flags = lib.GIT_DIFF_FIND_RENAMES
+        if self.copies:
+            options.flags |= lib.GIT_DIFF_FIND_COPIES
+        if self.exact_only:
+            options.flags |= lib.GIT_DIFF_FIND_EXACT_MATCH_ONLY
+        options.rename_threshold = self.threshold
+        options.copy_threshold = self.threshold
+        options.rename_limit = self.limit
+        return options
+
+    def within_budget(self, diff_list):
+        """check whether detection on diff_list fits within max_pairs"""
+        if self.max_pairs is None:
+            return True
+        targets = lib.git_diff_num_deltas_of_type(diff_list, lib.GIT_DELTA_ADDED)
+        sources = lib.git_diff_num_deltas_of_type(diff_list, lib.GIT_DELTA_DELETED)
+        if self.copies:
+            sources += lib.git_diff_num_deltas_of_type(diff_list, lib.GIT_DELTA_MODIFIED)
+        return targets * sources <= self.max_pairs
+
+
+class TreeChanges(dict):
+    """the dict of TreeChanges (or TreePatches) returned by Tree.diff
+
+    truncated and renames_truncated mirror the same attributes on TreeDiff.
+    """
+    truncated = False
+    renames_truncated = False
+
+    def copy(self):
+        changes = TreeChanges(self)
+        changes.truncated = self.truncated
+        changes.renames_truncated = self.renames_truncated
+        return changes
+
+
+class DiffLine(namedtuple('DiffLine', ['origin', 'content', 'old_lineno', 'new_lineno'])):
+    """represents a single line of a diff hunk
+
+    origin is the usual diff marker: '+', '-', or ' ' for context.  Line
+    numbers are -1 on the side the line does not exist on.
+    """
+
+
+class DiffHunk(namedtuple('DiffHunk', ['old_start', 'old_lines', 'new_start', 'new_lines', 'header', 'lines'])):
+    """represents a hunk of a diff, along with its DiffLines"""
+
+
+class TreePatch(namedtuple('TreePatch', ['change', 'additions', 'deletions', 'hunks'])):
+    """represents the patch for a single TreeChange
+
+    hunks is only present if the diff was performed with hunks enabled;
+    otherwise, it will be None.
+    """
+
+
+class TreeDiff(object):
+    """an iterator over the changes between two trees
+
+    You will usually get these from Tree.iterdiff rather than building them
+    yourself.  The underlying libgit2 diff is freed once iteration finishes,
+    or when close() is called.
 
+    truncated is set if max_files or max_bytes cut the diff short, and
+    renames_truncated if rename detection was skipped for exceeding its
+    RenameOptions budget.  Both are only meaningful once iteration starts.
+    max_bytes counts hunk line content, so it requires hunks.
+    """
+    def __init__(self, repo, old, new, renames=False, hunks=False, stats=False,
+                 max_files=None, max_bytes=None):
+        if max_bytes is not None and not hunks:
+            raise ValueError('max_bytes requires hunks')
+        self._repo = weakref.ref(repo)
+        self.truncated = False
+        self.renames_truncated = False
+        self._changes = self._iterate(old, new, renames, hunks, stats, max_files, max_bytes)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self._changes)
+
+    __next__ = next
+
+    def close(self):
+        self._changes.close()
+
+    def _iterate(self, old, new, renames, hunks, stats, max_files, max_bytes):
+        repo = self._repo()
         diff_list = None
         old_tree = None
-
-        new_tree = ffi.new('git_tree **')
-        if lib.git_tree_lookup(new_tree, self._repo().pointer, self.oid.pointer):
-            new_tree = None
-            raise error.GitException
-        new_tree = new_tree[0]
+        new_tree = None
 
         try:
-            if other is not None:
-                old_tree = ffi.new('git_tree **')
-                old_oid = other.oid.pointer if isinstance(other, Tree) else other.pointer
-                if lib.git_tree_lookup(old_tree,
-                                       self._repo().pointer,
-                                       old_oid):
-                    old_tree = None
+            trees = []
+            for tree in (old, new):
+                if tree is None:
+                    trees.append(None)
+                    continue
+                pointer = ffi.new('git_tree **')
+                if lib.git_tree_lookup(pointer, repo.pointer, Oid(tree.oid if isinstance(tree, Tree) else tree).pointer):
                     raise error.GitException
-                old_tree = old_tree[0]
+                trees.append(pointer[0])
+            old_tree, new_tree = trees
 
             diff_list = ffi.new('git_diff_list **')
             if lib.git_diff_tree_to_tree(diff_list,
-                                         self._repo().pointer,
+                                         repo.pointer,
                                          old_tree if old_tree is not None else ffi.NULL,
-                                         new_tree,
+                                         new_tree if new_tree is not None else ffi.NULL,
                                          ffi.NULL):
                 diff_list = None
                 raise error.GitException
             diff_list = diff_list[0]
 
-            if renames:
-                lib.git_diff_find_similar(diff_list, ffi.NULL)
-            changes = {}
-
-            @ffi.callback('int(git_diff_delta *, float, void *)')
-            def add_changed_file(delta, progress, payload):
-                new_name = ffi.string(delta.new_file.path) if delta.new_file.path != ffi.NULL else None
-                old_name = ffi.string(delta.old_file.path) if delta.old_file.path != ffi.NULL else None
-                key = new_name if new_name else old_name
-                if delta.status & lib.GIT_DELTA_RENAMED:
-                    status = TreeChange.RENAMED
-                elif delta.status & lib.GIT_DELTA_COPIED:
-                    status = TreeChange.COPIED
+            if isinstance(renames, RenameOptions):
+                if renames.within_budget(diff_list):
+                    if lib.git_diff_find_similar(diff_list, renames.find_options()):
+                        raise error.GitException
                 else:
-                    status = None
-                changes[key] = TreeChange(new_name,
-                                          old_name,
-                                          Oid(ffi.addressof(delta.old_file.oid)).sha,
-                                          Oid(ffi.addressof(delta.new_file.oid)).sha,
-                                          delta.old_file.mode,
-                                          delta.new_file.mode,
-                                          status
-                                          )
-                return 0
+                    self.renames_truncated = True
+            elif renames:
+                if lib.git_diff_find_similar(diff_list, ffi.NULL):
+                    raise error.GitException
 
-            if lib.git_diff_foreach(diff_list,
-                                    add_changed_file,
-                                    ffi.NULL,
-                                    ffi.NULL,
-                                    ffi.NULL):
-                raise error.GitException
-            return changes
+            want_patch = hunks or stats
+            patch = ffi.new('git_diff_patch **')
+            delta = ffi.new('git_diff_delta **')
+            total_bytes = 0
+            count = lib.git_diff_num_deltas(diff_list)
+            for idx in xrange(count):
+                if max_files is not None and idx >= max_files:
+                    self.truncated = True
+                    return
+                if lib.git_diff_get_patch(patch if want_patch else ffi.NULL, delta, diff_list, idx):
+                    raise error.GitException
+                change = _tree_change(delta[0])
+                if not want_patch:
+                    yield change
+                    continue
+                try:
+                    result, size = _tree_patch(change, patch[0], hunks)
+                finally:
+                    lib.git_diff_patch_free(patch[0])
+                total_bytes += size
+                if max_bytes is not None and total_bytes > max_bytes:
+                    self.truncated = True
+                    return
+                yield result
         finally:
             if new_tree is not None:
                 lib.git_tree_free(new_tree)
@@ -731,15 +1234,162 @@ class Tree(object):
             if diff_list is not None:
                 lib.git_diff_list_free(diff_list)
 
+
+def _tree_change(delta):
+    new_name = ffi.string(delta.new_file.path) if delta.new_file.path != ffi.NULL else None
+    old_name = ffi.string(delta.old_file.path) if delta.old_file.path != ffi.NULL else None
+    if delta.status == lib.GIT_DELTA_RENAMED:
+        status = TreeChange.RENAMED
+    elif delta.status == lib.GIT_DELTA_COPIED:
+        status = TreeChange.COPIED
+    else:
+        status = None
+    return TreeChange(new_name,
+                      old_name,
+                      util.sha(ffi.addressof(delta.old_file.oid)),
+                      util.sha(ffi.addressof(delta.new_file.oid)),
+                      delta.old_file.mode,
+                      delta.new_file.mode,
+                      status)
+
+
+def _tree_patch(change, patch, hunks):
+    """return a TreePatch for a git_diff_patch, plus the bytes of patch text seen"""
+    context = ffi.new('size_t *')
+    additions = ffi.new('size_t *')
+    deletions = ffi.new('size_t *')
+    if lib.git_diff_patch_line_stats(context, additions, deletions, patch):
+        raise error.GitException
+    if not hunks:
+        return TreePatch(change, additions[0], deletions[0], None), 0
+
+    size = 0
+    result = []
+    diff_range = ffi.new('git_diff_range **')
+    header = ffi.new('char **')
+    header_len = ffi.new('size_t *')
+    lines_in_hunk = ffi.new('size_t *')
+    origin = ffi.new('char *')
+    content = ffi.new('char **')
+    content_len = ffi.new('size_t *')
+    old_lineno = ffi.new('int *')
+    new_lineno = ffi.new('int *')
+    for hunk_idx in xrange(lib.git_diff_patch_num_hunks(patch)):
+        if lib.git_diff_patch_get_hunk(diff_range, header, header_len, lines_in_hunk, patch, hunk_idx):
+            raise error.GitException
+        r = diff_range[0]
+        lines = []
+        for line_idx in xrange(lines_in_hunk[0]):
+            if lib.git_diff_patch_get_line_in_hunk(origin, content, content_len,
+                                                   old_lineno, new_lineno,
+                                                   patch, hunk_idx, line_idx):
+                raise error.GitException
+            size += content_len[0]
+            lines.append(DiffLine(origin[0],
+                                  ffi.buffer(content[0], content_len[0])[:],
+                                  old_lineno[0],
+                                  new_lineno[0]))
+        result.append(DiffHunk(r.old_start, r.old_lines, r.new_start, r.new_lines,
+                               ffi.buffer(header[0], header_len[0])[:], lines))
+    return TreePatch(change, additions[0], deletions[0], result), size
+
+
+class Tree(object):
+    """represents a Git tree object
+
+    By default, reading a tree realizes its entire recursive manifest in
+    one go.  Lazy trees instead load each directory level only when it is
+    accessed, which is far cheaper when you only need part of a large
+    tree.  Either way, single-path lookups via lookup(), [], in, and mode()
+    resolve just the path in question if the manifest hasn't been read.
+    """
+    def __init__(self, repo, oid=None, lazy=False):
+        self._repo = weakref.ref(repo)
+        self.oid = Oid(oid) if oid else None
+        self.lazy = lazy
+        self._entries = {}
+        self._manifest = {}
+
+    def __contains__(self, name):
+        try:
+            self._file_entry(name)
+            return True
+        except KeyError:
+            return False
+
+    def __getitem__(self, name):
+        return Blob(self._repo(), self._file_entry(name).sha)
+
+    def diff(self, other, renames=False, hunks=False, stats=False):
+        """calculate the diff across two trees
+
+        If you do not specify hunks, you will only get the files
+        changes.  If you do not specify renames, then no rename
+        tracking will be performed; pass a RenameOptions rather than
+        True to tune or budget it.
+
+        The result is a TreeChanges dict keyed by path.  Its values are
+        TreeChanges, or TreePatches if hunks or stats were requested.  See
+        iterdiff if you'd rather not build the whole dict at once.
+
+        Results are cached on the repository by the pair of tree ids and
+        the options used.  Only the two tree ids are needed, so a cached
+        diff is returned without reading either tree."""
+        cache = self._repo()._diff_cache
+        key = None
+        if self.oid is not None:
+            old_sha = None
+            if other is not None:
+                old_sha = other.sha if isinstance(other, Tree) else Oid(other).sha
+            rename_key = renames.key if isinstance(renames, RenameOptions) else bool(renames)
+            key = (old_sha, self.sha, rename_key, bool(hunks), bool(stats))
+            cached = cache.get(key)
+            if cached is not None:
+                return cached.copy()
+
+        changes = TreeChanges()
+        diff = self.iterdiff(other, renames=renames, hunks=hunks, stats=stats)
+        for change in diff:
+            path = change.change if isinstance(change, TreePatch) else change
+            changes[path.new_path if path.new_path else path.old_path] = change
+        changes.truncated = diff.truncated
+        changes.renames_truncated = diff.renames_truncated
+        if key is not None:
+            cache[key] = changes.copy()
+        return changes
+
+    def iterdiff(self, other, renames=False, hunks=False, stats=False,
+                 max_files=None, max_bytes=None):
+        """lazily calculate the diff across two trees
+
+        Returns a TreeDiff, which yields a TreeChange per changed file as
+        libgit2 produces them.  renames works as it does for diff.  If
+        hunks or stats is set, it yields TreePatches instead, carrying added
+        and removed line counts and (for hunks) the hunks themselves.  The
+        trees themselves are never read into Python.
+
+        max_files stops the diff after that many files, and max_bytes
+        stops it once that much hunk line content has been produced; check
+        the TreeDiff's truncated attribute to see whether that happened.
+        Only hunks produce patch text, so max_bytes without hunks raises a
+        ValueError.
+        """
+        return TreeDiff(self._repo(), other, self, renames=renames, hunks=hunks, stats=stats,
+                        max_files=max_files, max_bytes=max_bytes)
+
     def read(self):
         """reads this tree, *plus* fully realizes the manifest cache
 
         This is a no-op if a tree is being built, rather than already stored in
-        the ODB, and is also a no-op if the tree has already been read.
+        the ODB, and is also a no-op if the tree has already been read.  Lazy
+        trees only prepare their top level here; see Tree.manifest.
         """
 
         if self.oid is None or self._entries:
             return
+        if self.lazy:
+            self._entries = _LazyChildren(self._repo(), self.sha)
+            return
         tree = ffi.new('git_tree **')
         if lib.git_tree_lookup(tree, self._repo().pointer, self.oid.pointer):
             raise error.GitException
@@ -758,10 +1408,11 @@ class Tree(object):
                     base = base.children[directory]
             name = ffi.string(lib.git_tree_entry_name(entry))
             mode = lib.git_tree_entry_filemode(entry)
-            sha = Oid(lib.git_tree_entry_id(entry)).sha
+            sha = util.sha(lib.git_tree_entry_id(entry))
             if mode & lib.GIT_FILEMODE_TREE:
-                if sha in cache:
-                    base.children[name] = cache[sha]
+                cached = cache.get(sha)
+                if cached is not None:
+                    base.children[name] = cached
                     return 1
                 else:
                     sha_map[sha] = base.children[name] = TreeEntry(name, sha, mode)
@@ -791,12 +1442,15 @@ class Tree(object):
         # and exist
         repo = self._repo()
         if verify:
-            queue = self._entries.values()
-            while queue:
-                entry = queue.pop()
-                queue.extend(getattr(entry, 'children', {}).viewvalues())
-                if not repo.contains_object(entry.sha):
-                    raise ValueError('child trees have not been properly serialized')
+            # A child that's in the ODB brings its whole subtree with it, so
+            # only this level needs checking; never touch children, which
+            # on a lazy tree would load every subtree
+            if repo.contains_objects(set(entry.sha for entry in self._entries.values())):
+                raise ValueError('child trees have not been properly serialized')
+        if repo._transaction is not None:
+            self.oid = repo._transaction.add(lib.GIT_OBJ_TREE, self._serialize())
+            repo._known_objects[self.sha] = True
+            return
         builder = ffi.new('git_treebuilder **')
         if lib.git_treebuilder_create(builder, ffi.NULL):
             raise error.GitException
@@ -809,9 +1463,16 @@ class Tree(object):
             if lib.git_treebuilder_write(oid, repo.pointer, builder):
                 raise error.GitException
             self.oid = Oid(oid)
+            repo._known_objects[self.sha] = True
         finally:
             lib.git_treebuilder_free(builder)
 
+    def _serialize(self):
+        # Git sorts directories as though their names ended in a slash
+        entries = sorted(self._entries.values(),
+                         key=lambda e: e.name + '/' if e.mode == lib.GIT_FILEMODE_TREE else e.name)
+        return ''.join('%o %s\0%s' % (e.mode, e.name, Oid(e.sha).raw) for e in entries)
+
     def add_entry(self, entry):
         """adds a given TreeEntry to this tree"""
         self.oid = None
@@ -819,9 +1480,44 @@ class Tree(object):
             self._entries = {}
         self._entries[entry.name] = entry
 
+    def lookup(self, path):
+        """return the TreeEntry at a given path
+
+        Unlike the manifest, this resolves only the directories along the
+        path, so it is cheap even on very large trees.  Directories can be
+        looked up as well as files; their children load lazily.  Throws a
+        KeyError if nothing exists at path.
+        """
+        if path in self._manifest:
+            return self._manifest[path]
+        if self.oid is None:
+            raise KeyError(path)
+        repo = self._repo()
+        tree = ffi.new('git_tree **')
+        if lib.git_tree_lookup(tree, repo.pointer, self.oid.pointer):
+            raise error.GitException
+        tree = tree[0]
+        try:
+            entry = ffi.new('git_tree_entry **')
+            err = lib.git_tree_entry_bypath(entry, tree, path)
+            if err:
+                if err == lib.GIT_ENOTFOUND:
+                    raise KeyError(path)
+                raise error.GitException
+            entry = entry[0]
+            name = ffi.string(lib.git_tree_entry_name(entry))
+            mode = lib.git_tree_entry_filemode(entry)
+            sha = util.sha(lib.git_tree_entry_id(entry))
+            lib.git_tree_entry_free(entry)
+        finally:
+            lib.git_tree_free(tree)
+        result = TreeEntry(name, sha, mode)
+        if mode & lib.GIT_FILEMODE_TREE:
+            result.children = _LazyChildren(repo, sha)
+        return result
+
     def mode(self, path):
-        self.read()
-        return self._manifest[path].mode
+        return self._file_entry(path).mode
 
     @property
     def children(self):
@@ -840,8 +1536,13 @@ class Tree(object):
 
     @property
     def manifest(self):
-        """return the fully realized tree under this point with full paths"""
+        """return the fully realized tree under this point with full paths
+
+        On lazy trees, this loads every directory that hasn't been loaded yet.
+        """
         self.read()
+        if self.lazy and self.oid is not None and not self._manifest:
+            self._flatten('', self, self._manifest)
         return self._manifest
 
     @property
@@ -852,6 +1553,15 @@ class Tree(object):
         """
         return self.oid.sha if self.oid else None
 
+    def _file_entry(self, path):
+        if self.oid is None or self._manifest:
+            self.read()
+            return self._manifest[path]
+        entry = self.lookup(path)
+        if entry.is_directory:
+            raise KeyError(path)
+        return entry
+
     def _flatten(self, base, tree, manifest):
         for k, v in tree.children.viewitems():
             full = k if not base else base + '/' + k
@@ -867,25 +1577,48 @@ class Walker(object):
     You almost never need to instantiate this class directly.  Instead, you can usually
     work with Repo's .walker property.  You should only ever create a Walker manually
     if you need to do multiple, simultaneous walks.
+
+    Walks are topologically sorted by default, which forces libgit2 to walk
+    the entire history before yielding the first commit.  Sorting by 'time'
+    or 'none' instead streams commits as they are found, which is much
+    faster when you only want the first few.
     """
 
+    SORT_MODES = {
+        'none': lib.GIT_SORT_NONE,
+        'topological': lib.GIT_SORT_TOPOLOGICAL,
+        'time': lib.GIT_SORT_TIME,
+        'reverse': lib.GIT_SORT_REVERSE,
+    }
+
     def __init__(self, repo):
         self._repo = weakref.ref(repo)
         self._walker = None
         self._walking = False
         self._limit = None
+        self._oid = None
 
     def close(self):
         if self._walker:
             lib.git_revwalk_free(self._walker)
             self._walker = None
 
-    def open(self, include=[], exclude=[], limit=None):
+    def open(self, include=[], exclude=[], limit=None, sort='topological'):
         """open the walker for walking
 
+        sort is one of Walker.SORT_MODES, or an iterable of them to combine
+        (such as ('time', 'reverse')).
+
         Note that this walker can only perform one walk at once.  Create
         multiple Walkers if you need to perform multiple walks simultaneously.
         """
+        if isinstance(sort, basestring):
+            sort = [sort]
+        sort_mode = lib.GIT_SORT_NONE
+        for mode in sort:
+            if mode not in self.SORT_MODES:
+                raise ValueError('unknown sort mode: %s' % mode)
+            sort_mode |= self.SORT_MODES[mode]
 
         self._ensure_walker_allocated()
         lib.git_revwalk_reset(self._walker)
@@ -895,7 +1628,7 @@ class Walker(object):
             lib.git_revwalk_push(self._walker, Oid(str(sha)).pointer)
         for sha in exclude:
             lib.git_revwalk_hide(self._walker, Oid(str(sha)).pointer)
-        lib.git_revwalk_sorting(self._walker, lib.GIT_SORT_TOPOLOGICAL)
+        lib.git_revwalk_sorting(self._walker, sort_mode)
         self._limit = limit
         self._walking = True
         self._remaining = self._limit
@@ -906,13 +1639,43 @@ class Walker(object):
         return self
 
     def next(self):
-        oid = ffi.new('git_oid *')
-        if self._remaining == 0 or lib.git_revwalk_next(oid, self._walker) == lib.GIT_ITEROVER:
+        if self._oid is None:
+            self._oid = ffi.new('git_oid *')
+        if self._remaining == 0 or lib.git_revwalk_next(self._oid, self._walker) == lib.GIT_ITEROVER:
             self._walking = False
             raise StopIteration
         if self._remaining is not None:
             self._remaining -= 1
-        return Oid(oid)
+        return self._repo().oid(self._oid)
+
+    def next_batch(self, n):
+        """return a list of up to n more Oids from this walk
+
+        An empty list means the walk is over.  This is considerably cheaper
+        per commit than iterating one Oid at a time.
+        """
+        if not self._walking:
+            return []
+        if self._remaining is not None:
+            n = min(n, self._remaining)
+        if self._oid is None:
+            self._oid = ffi.new('git_oid *')
+        oid = self._oid
+        walker = self._walker
+        revwalk_next = lib.git_revwalk_next
+        iterover = lib.GIT_ITEROVER
+        intern = self._repo().oid
+        batch = []
+        while len(batch) < n:
+            if revwalk_next(oid, walker) == iterover:
+                self._walking = False
+                break
+            batch.append(intern(oid))
+        if self._remaining is not None:
+            self._remaining -= len(batch)
+            if self._remaining == 0:
+                self._walking = False
+        return batch
 
     def _ensure_walker_allocated(self):
         if self._walker:
@@ -0,0 +1,237 @@
+import threading
+import weakref
+
+from .core import lib, ffi
+from .pack import Transaction
+from . import error, util
+
+# Backends are consulted highest priority first; libgit2's own loose and
+# pack backends sit at 1 and 2
+_MEMORY_PRIORITY = 1000
+
+
+class MemoryOdb(object):
+    """an in-memory object store layered over a repository's ODB
+
+    Once attached, every object libgit2 writes through the repository--
+    blobs, trees, commits, merge results--lands in memory instead of on
+    disk, and reads check memory before falling through to the on-disk
+    store.  Call flush() to write what's in memory out as a single pack,
+    or discard() to throw it all away.
+
+    Memory use is bounded by max_bytes of object data.  Writes that would
+    exceed it aren't held in memory; they're written straight to disk as
+    loose objects instead, and counted in stats as spilled.
+
+    libgit2 offers no way to take a backend back out of an ODB, so
+    detach() only empties this store and sends new objects straight to
+    disk.  You will usually get one of these from Repo.use_memory_odb.
+    """
+
+    def __init__(self, repo, max_bytes=None):
+        self._repo = weakref.ref(repo)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.spilled = 0
+        self.enabled = True
+        self._objects = {}
+        self._lock = threading.RLock()
+        self._attached = False
+        self._loose = None
+        self._backend = ffi.new('git_odb_backend *')
+        self._callbacks = self._make_callbacks()
+        self._backend.version = lib.GIT_ODB_BACKEND_VERSION
+        for name, callback in self._callbacks.items():
+            setattr(self._backend, name, callback)
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __contains__(self, sha):
+        return self._repo().oid(sha).raw in self._objects
+
+    def attach(self):
+        """layer this store over the repository's on-disk ODB"""
+        if self._attached:
+            return
+        if lib.git_odb_add_backend(self._repo().odb_pointer, self._backend, _MEMORY_PRIORITY):
+            raise error.GitException
+        self._attached = True
+
+    def detach(self):
+        """discard everything in memory and send new objects to disk"""
+        self.enabled = False
+        self.discard()
+
+    def discard(self):
+        """throw away every object held in memory"""
+        with self._lock:
+            objects = self._objects
+            self._objects = {}
+            self.bytes = 0
+        # Tree.write remembers what it wrote; none of it exists anymore
+        known = self._repo()._known_objects
+        for raw in objects:
+            try:
+                del known[util.hexlify(raw)]
+            except KeyError:
+                pass
+
+    def flush(self):
+        """write every object held in memory to disk as one pack"""
+        with self._lock:
+            objects = self._objects.items()
+        if not objects:
+            return
+        transaction = Transaction(self._repo())
+        try:
+            for raw, (type, data) in objects:
+                transaction.add(type, data)
+        except:
+            transaction.rollback()
+            raise
+        transaction.commit()
+        with self._lock:
+            for raw, (type, data) in objects:
+                if self._objects.pop(raw, None) is not None:
+                    self.bytes -= len(data)
+
+    @property
+    def stats(self):
+        """a dict of the current counters for this store"""
+        return {
+            'entries': len(self._objects),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'spilled': self.spilled,
+        }
+
+    def _find(self, oid):
+        # Called from libgit2, possibly on one of its own threads
+        with self._lock:
+            found = self._objects.get(util.raw(oid)) if self.enabled else None
+            if found is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return found
+
+    def _spill(self, oid, data, size, type):
+        # libgit2 only moves on to the next backend when a whole-object
+        # write fails, not a streamed one (which is how blobs are written),
+        # so write the loose object ourselves
+        with self._lock:
+            if self._loose is None:
+                loose = ffi.new('git_odb_backend **')
+                if lib.git_odb_backend_loose(loose, self._repo().odb_path, -1, 0):
+                    return lib.GIT_ERROR
+                self._loose = loose[0]
+            loose = self._loose
+        return loose.write(oid, loose, data, size, type)
+
+    def _make_callbacks(self):
+        # The C struct holds raw pointers to these, so they're kept alive
+        # for as long as this object is
+
+        @ffi.callback('int(void **, size_t *, git_otype *, git_odb_backend *, const git_oid *)',
+                      error=lib.GIT_ERROR)
+        def read(data_out, size_out, type_out, backend, oid):
+            found = self._find(oid)
+            if found is None:
+                return lib.GIT_ENOTFOUND
+            type, data = found
+            # libgit2 frees what we hand back, so it has to come from its allocator
+            buf = lib.git_odb_backend_malloc(backend, len(data))
+            if buf == ffi.NULL:
+                return lib.GIT_ERROR
+            ffi.buffer(buf, len(data))[:] = data
+            data_out[0] = buf
+            size_out[0] = len(data)
+            type_out[0] = type
+            return 0
+
+        @ffi.callback('int(git_oid *, void **, size_t *, git_otype *, git_odb_backend *, const git_oid *, size_t)',
+                      error=lib.GIT_ERROR)
+        def read_prefix(oid_out, data_out, size_out, type_out, backend, short_oid, length):
+            prefix = util.sha(short_oid)[:length]
+            with self._lock:
+                matches = [raw for raw in self._objects if util.hexlify(raw).startswith(prefix)] if self.enabled else []
+            if not matches:
+                return lib.GIT_ENOTFOUND
+            if len(matches) > 1:
+                return lib.GIT_EAMBIGUOUS
+            oid = util.oid_from_raw(matches[0])
+            err = read(data_out, size_out, type_out, backend, oid)
+            if not err:
+                oid_out[0] = oid[0]
+            return err
+
+        @ffi.callback('int(size_t *, git_otype *, git_odb_backend *, const git_oid *)', error=lib.GIT_ERROR)
+        def read_header(size_out, type_out, backend, oid):
+            found = self._find(oid)
+            if found is None:
+                return lib.GIT_ENOTFOUND
+            size_out[0] = len(found[1])
+            type_out[0] = found[0]
+            return 0
+
+        @ffi.callback('int(git_oid *, git_odb_backend *, const void *, size_t, git_otype)', error=lib.GIT_ERROR)
+        def write(oid, backend, data, size, type):
+            # oid is ours to fill in
+            if lib.git_odb_hash(oid, data, size, type):
+                return lib.GIT_ERROR
+            with self._lock:
+                held = self.enabled and (self.max_bytes is None or self.bytes + size <= self.max_bytes)
+                if held:
+                    raw = util.raw(oid)
+                    if raw not in self._objects:
+                        self._objects[raw] = (type, ffi.buffer(data, size)[:])
+                        self.bytes += size
+                    self.writes += 1
+                elif self.enabled:
+                    self.spilled += 1
+            if held:
+                return 0
+            return self._spill(oid, data, size, type)
+
+        @ffi.callback('int(git_odb_backend *, const git_oid *)', error=0)
+        def exists(backend, oid):
+            with self._lock:
+                return int(self.enabled and util.raw(oid) in self._objects)
+
+        @ffi.callback('int(git_odb_backend *, git_odb_foreach_cb, void *)', error=lib.GIT_ERROR)
+        def foreach(backend, cb, payload):
+            with self._lock:
+                raws = list(self._objects) if self.enabled else []
+            for raw in raws:
+                if cb(util.oid_from_raw(raw), payload):
+                    return lib.GIT_EUSER
+            return 0
+
+        @ffi.callback('void(git_odb_backend *)')
+        def free(backend):
+            # The ODB is going away with the repository; anything held here
+            # survives to be attached again if it's reopened, which libgit2
+            # only allows once the backend no longer claims the old ODB
+            backend.odb = ffi.NULL
+            self._attached = False
+            with self._lock:
+                loose, self._loose = self._loose, None
+            if loose is not None:
+                loose.free(loose)
+
+        return {
+            'read': read,
+            'read_prefix': read_prefix,
+            'read_header': read_header,
+            'write': write,
+            'exists': exists,
+            'foreach': foreach,
+            'free': free,
+        }
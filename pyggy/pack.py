@@ -0,0 +1,343 @@
+from collections import namedtuple
+from os.path import join as pathjoin
+import errno
+import hashlib
+import os
+import struct
+import tempfile
+import time
+import weakref
+import zlib
+
+from .core import lib, ffi
+from .objects import Walker
+from . import error, util
+
+_PACK_HEADER = struct.Struct('>4sII')
+_PACK_VERSION = 2
+_CHUNK_SIZE = 1 << 20
+
+
+class PackStats(namedtuple('PackStats', ('objects', 'bytes'))):
+    """the number of objects in, and the size of, a pack written by Repo.pack"""
+
+
+def write_pack(repo, out, include=[], exclude=[], threads=None, progress=None):
+    """build a pack of a revision range and stream it to a file-like object
+
+    include and exclude work as they do for Walker.open.  The pack holds
+    every commit in the range along with every tree and blob they reach
+    that isn't also reachable from the commits just outside it, so it's
+    exactly what a repository that already has exclude needs.  Deltas are
+    searched for on threads threads; None lets libgit2 use one per CPU.
+
+    progress, if given, is called as progress(stage, current, total):
+    first with stage 'counting', once per commit added, and then with
+    stage 'writing' and the number of bytes written so far (total is None
+    while writing).  Returns a PackStats.  You will usually want Repo.pack
+    rather than calling this directly.
+    """
+    walker = Walker(repo)
+    walker.open(include=include, exclude=exclude)
+    try:
+        commits = list(walker)
+    finally:
+        walker.close()
+
+    builder = ffi.new('git_packbuilder **')
+    if lib.git_packbuilder_new(builder, repo.pointer):
+        raise error.GitException
+    builder = builder[0]
+    try:
+        lib.git_packbuilder_set_threads(builder, threads or 0)
+        if exclude:
+            _insert_range(repo, builder, commits, progress)
+        else:
+            # Nothing to leave out, so libgit2 can add whole commits itself
+            for idx, oid in enumerate(commits):
+                if lib.git_packbuilder_insert_commit(builder, oid.pointer):
+                    raise error.GitException
+                if progress:
+                    progress('counting', idx + 1, len(commits))
+        return _stream_pack(builder, out, progress)
+    finally:
+        lib.git_packbuilder_free(builder)
+
+
+def _insert_range(repo, builder, commits, progress):
+    info = dict((oid, _commit_info(repo, oid)) for oid in commits)
+    boundary = set(parent
+                   for tree, parents in info.itervalues()
+                   for parent in parents
+                   if parent not in info)
+    # Mark everything the other end already has as seen before adding
+    # anything, so only new trees and blobs go in
+    seen = set()
+    for parent in boundary:
+        _insert_tree(repo, None, _commit_info(repo, parent)[0], seen)
+    for idx, oid in enumerate(commits):
+        if lib.git_packbuilder_insert(builder, oid.pointer, ffi.NULL):
+            raise error.GitException
+        _insert_tree(repo, builder, info[oid][0], seen)
+        if progress:
+            progress('counting', idx + 1, len(commits))
+
+
+def _commit_info(repo, oid):
+    commit = ffi.new('git_commit **')
+    err = lib.git_commit_lookup(commit, repo.pointer, oid.pointer)
+    if err:
+        if err == lib.GIT_ENOTFOUND:
+            raise KeyError(oid.sha)
+        raise error.GitException
+    commit = commit[0]
+    try:
+        parents = [repo.oid(lib.git_commit_parent_id(commit, idx))
+                   for idx in xrange(lib.git_commit_parentcount(commit))]
+        return repo.oid(lib.git_commit_tree_id(commit)), parents
+    finally:
+        lib.git_commit_free(commit)
+
+
+def _insert_tree(repo, builder, oid, seen):
+    # Add a tree and everything under it that isn't in seen, or, with no
+    # builder, just mark it all as seen
+    if oid.raw in seen:
+        return
+    seen.add(oid.raw)
+    if builder is not None and lib.git_packbuilder_insert(builder, oid.pointer, ffi.NULL):
+        raise error.GitException
+    stack = [(oid.raw, '')]
+    while stack:
+        raw, path = stack.pop()
+        tree = ffi.new('git_tree **')
+        if lib.git_tree_lookup(tree, repo.pointer, util.oid_from_raw(raw)):
+            raise error.GitException
+        tree = tree[0]
+        try:
+            for idx in xrange(lib.git_tree_entrycount(tree)):
+                entry = lib.git_tree_entry_byindex(tree, idx)
+                kind = lib.git_tree_entry_type(entry)
+                if kind not in (lib.GIT_OBJ_TREE, lib.GIT_OBJ_BLOB):
+                    # Submodule commits live in another repository
+                    continue
+                entry_id = lib.git_tree_entry_id(entry)
+                entry_raw = util.raw(entry_id)
+                if entry_raw in seen:
+                    continue
+                seen.add(entry_raw)
+                entry_path = path + ffi.string(lib.git_tree_entry_name(entry))
+                if builder is not None and lib.git_packbuilder_insert(builder, entry_id, entry_path):
+                    raise error.GitException
+                if kind == lib.GIT_OBJ_TREE:
+                    stack.append((entry_raw, entry_path + '/'))
+        finally:
+            lib.git_tree_free(tree)
+
+
+def _stream_pack(builder, out, progress):
+    written = [0]
+    failure = []
+
+    @ffi.callback('int(void *, size_t, void *)')
+    def write(data, size, payload):
+        try:
+            out.write(ffi.buffer(data, size)[:])
+            written[0] += size
+            if progress:
+                progress('writing', written[0], None)
+        except Exception as e:
+            # Let libgit2 unwind, then raise this once it has
+            failure.append(e)
+            return -1
+        return 0
+
+    err = lib.git_packbuilder_foreach(builder, write, ffi.NULL)
+    if failure:
+        raise failure[0]
+    if err:
+        raise error.GitException
+    return PackStats(lib.git_packbuilder_object_count(builder), written[0])
+
+
+class TransferProgress(namedtuple('TransferProgress', ('total_objects', 'indexed_objects', 'received_objects',
+                                                       'received_bytes', 'bytes_per_second'))):
+    """a snapshot of how far along ingesting a pack is"""
+
+
+def ingest_pack(repo, fileobj, chunk_size=_CHUNK_SIZE, progress=None):
+    """index a pack read from a file-like object into the repository
+
+    The pack is read and handed to libgit2's indexer chunk_size bytes at a
+    time, so memory use stays bounded however large it is.  progress, if
+    given, is called with a TransferProgress as objects are received and
+    indexed.  Returns the name of the new pack (pack-<sha>), whose .pack
+    and .idx files now sit in the object store's pack directory.  You will
+    usually want Repo.ingest_pack rather than calling this directly.
+    """
+    directory = _pack_directory(repo)
+    started = time.time()
+    failure = []
+
+    @ffi.callback('int(const git_transfer_progress *, void *)')
+    def report(stats, payload):
+        try:
+            elapsed = time.time() - started
+            progress(TransferProgress(stats.total_objects, stats.indexed_objects, stats.received_objects,
+                                      stats.received_bytes, stats.received_bytes / elapsed if elapsed else 0.0))
+        except Exception as e:
+            failure.append(e)
+            return -1
+        return 0
+
+    indexer = ffi.new('git_indexer_stream **')
+    if lib.git_indexer_stream_new(indexer, directory, report if progress else ffi.NULL, ffi.NULL):
+        raise error.GitException
+    indexer = indexer[0]
+    stats = ffi.new('git_transfer_progress *')
+    try:
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            err = lib.git_indexer_stream_add(indexer, chunk, len(chunk), stats)
+            if failure:
+                raise failure[0]
+            if err:
+                raise error.GitException
+        err = lib.git_indexer_stream_finalize(indexer, stats)
+        if failure:
+            raise failure[0]
+        if err:
+            raise error.GitException
+        name = 'pack-' + util.sha(lib.git_indexer_stream_hash(indexer))
+    finally:
+        lib.git_indexer_stream_free(indexer)
+    lib.git_odb_refresh(repo.odb_pointer)
+    return name
+
+
+class Transaction(object):
+    """a batch of new objects bound for the ODB as a single pack
+
+    While a transaction is active on a Repo, Blob.write, Tree.write, and
+    Commit.write hash and compress their objects into a temporary file
+    instead of writing loose objects.  commit() then hands that file to
+    the ODB as one pack, which is indexed as it goes in; rollback() simply
+    throws it away.  Objects written in a transaction can't be read back
+    until it commits, though they do count as present when verifying
+    trees.
+
+    You will usually want Repo.transaction rather than creating one of
+    these directly.
+    """
+
+    def __init__(self, repo):
+        self._repo = weakref.ref(repo)
+        self._file = tempfile.TemporaryFile(dir=_pack_directory(repo))
+        self._objects = set()
+        self.bytes = 0
+        self.done = False
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __contains__(self, sha):
+        return self._repo().oid(sha).raw in self._objects
+
+    def add(self, type, data):
+        """buffer an object of a given git_otype, returning its Oid"""
+        if self.done:
+            raise ValueError('transaction is already finished')
+        oid = ffi.new('git_oid *')
+        if lib.git_odb_hash(oid, data, len(data), type):
+            raise error.GitException
+        raw = util.raw(oid)
+        if raw not in self._objects:
+            entry = _object_header(type, len(data)) + zlib.compress(data)
+            self._file.write(entry)
+            self._objects.add(raw)
+            self.bytes += len(entry)
+        return self._repo()._intern(raw)
+
+    def commit(self):
+        """write every buffered object to the ODB as one pack"""
+        if self.done:
+            raise ValueError('transaction is already finished')
+        try:
+            if self._objects:
+                self._write_pack()
+        except:
+            self.rollback()
+            raise
+        self.done = True
+        self._file.close()
+
+    def rollback(self):
+        """discard every buffered object"""
+        if self.done:
+            return
+        self.done = True
+        self._file.close()
+        # Tree.write remembers what it wrote; none of it exists after all
+        known = self._repo()._known_objects
+        for raw in self._objects:
+            try:
+                del known[util.hexlify(raw)]
+            except KeyError:
+                pass
+
+    def _write_pack(self):
+        repo = self._repo()
+        writepack = ffi.new('git_odb_writepack **')
+        if lib.git_odb_write_pack(writepack, repo.odb_pointer, ffi.NULL, ffi.NULL):
+            raise error.GitException
+        writepack = writepack[0]
+        stats = ffi.new('git_transfer_progress *')
+        try:
+            for chunk in self._pack_chunks():
+                if writepack.add(writepack, chunk, len(chunk), stats):
+                    raise error.GitException
+            if writepack.commit(writepack, stats):
+                raise error.GitException
+        finally:
+            writepack.free(writepack)
+        lib.git_odb_refresh(repo.odb_pointer)
+
+    def _pack_chunks(self):
+        digest = hashlib.sha1()
+        header = _PACK_HEADER.pack('PACK', _PACK_VERSION, len(self._objects))
+        digest.update(header)
+        yield header
+        self._file.seek(0)
+        while True:
+            chunk = self._file.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            yield chunk
+        yield digest.digest()
+
+
+def _pack_directory(repo):
+    directory = pathjoin(repo.odb_path, 'pack')
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return directory
+
+
+def _object_header(type, size):
+    # Type and size, least significant bits first, seven bits per byte
+    # after the first four bits of size
+    byte = (type << 4) | (size & 0x0f)
+    size >>= 4
+    header = []
+    while size:
+        header.append(chr(byte | 0x80))
+        byte = size & 0x7f
+        size >>= 7
+    header.append(chr(byte))
+    return ''.join(header)
@@ -0,0 +1,100 @@
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import threading
+
+from .objects import Walker
+
+_process_state = {}
+
+
+def map_commits(repo, fn, include=[], exclude=[], limit=None, workers=None,
+                backend='thread', ordered=True, chunksize=None, cache_entries=None,
+                cache_bytes=None):
+    """apply fn to every commit in a revision range across a pool of workers
+
+    The range is walked up front in repo, and each worker then opens its
+    own handle on the same repository, so no libgit2 object is ever shared
+    between threads or processes.  fn receives a Commit loaded from the
+    worker's handle.
+
+    backend is 'thread' or 'process'.  Threads are cheapest, and libgit2
+    releases the GIL while it works, but any pure-Python work in fn is
+    still serialized; processes avoid that, at the cost of fn and its
+    results having to be picklable.  Results are yielded in walk order if
+    ordered is set, or as soon as they complete otherwise.
+
+    Each worker's caches are bounded by cache_entries and cache_bytes.
+    If neither is given, workers take the bounds of repo's commit cache,
+    or a small default if that's unbounded.  You will usually want
+    Repo.map_commits rather than calling this directly.
+    """
+    if backend not in ('thread', 'process'):
+        raise ValueError('unknown backend: %s' % backend)
+    from . import startup
+    startup()
+
+    walker = Walker(repo)
+    walker.open(include=include, exclude=exclude, limit=limit)
+    try:
+        shas = [oid.sha for oid in walker]
+    finally:
+        walker.close()
+    if chunksize is None:
+        chunksize = max(1, len(shas) // ((workers or 4) * 8))
+
+    repo_kwargs = repo._worker_kwargs(cache_entries, cache_bytes)
+
+    if backend == 'thread':
+        return _map_threads(type(repo), repo.path, repo_kwargs, fn, shas, workers, ordered, chunksize)
+    return _map_processes(type(repo), repo.path, repo_kwargs, fn, shas, workers, ordered, chunksize)
+
+
+def _map_threads(repo_class, path, repo_kwargs, fn, shas, workers, ordered, chunksize):
+    local = threading.local()
+    lock = threading.Lock()
+    handles = []
+
+    def run(sha):
+        repo = getattr(local, 'repo', None)
+        if repo is None:
+            repo = local.repo = repo_class(path, **repo_kwargs)
+            repo.open()
+            with lock:
+                handles.append(repo)
+        return fn(repo.commit(sha))
+
+    pool = ThreadPool(workers)
+    try:
+        results = pool.imap(run, shas, chunksize) if ordered else pool.imap_unordered(run, shas, chunksize)
+        for result in results:
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        for repo in handles:
+            repo.close()
+
+
+def _map_processes(repo_class, path, repo_kwargs, fn, shas, workers, ordered, chunksize):
+    pool = Pool(workers, _init_process, (repo_class, path, repo_kwargs, fn))
+    try:
+        results = (pool.imap(_run_in_process, shas, chunksize) if ordered
+                   else pool.imap_unordered(_run_in_process, shas, chunksize))
+        for result in results:
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _init_process(repo_class, path, repo_kwargs, fn):
+    repo = repo_class(path, **repo_kwargs)
+    repo.open()
+    _process_state['repo'] = repo
+    _process_state['fn'] = fn
+
+
+def _run_in_process(sha):
+    return _process_state['fn'](_process_state['repo'].commit(sha))
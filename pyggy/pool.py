@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+
+from .repo import Repo
+
+
+class RepoPool(object):
+    """a thread-safe pool of open repositories, for serving many repos at once
+
+    Check a Repo out by path, use it from a single thread, and check it back
+    in when you're done (or use the repo() context manager, which does both).
+    Several threads may check out the same path at once; each gets its own
+    handle.
+
+    At most max_open libgit2 handles are open at any time.  When the pool is
+    full, the least recently used idle handle is closed, but its Repo is kept
+    around--caches and all--so the next checkout of that path only has to
+    reopen it.  Those dormant repos are dropped, least recently used first,
+    once their estimated cache footprint exceeds cache_bytes.  If every
+    handle is checked out, checkout blocks until one is checked in.
+
+    Any other keyword arguments are handed to Repo when opening a new
+    repository, so you can, for instance, bound each repo's caches.
+    """
+
+    def __init__(self, max_open=64, cache_bytes=None, repo_class=Repo, **repo_kwargs):
+        self.max_open = max_open
+        self.cache_bytes = cache_bytes
+        self._repo_class = repo_class
+        self._repo_kwargs = repo_kwargs
+        self._lock = threading.Condition()
+        self._open = 0
+        self._idle = _LRUSet()
+        # A dormant repo is closed, so its caches hold still; weigh it once
+        self._dormant = _LRUSet(weigh=_cache_bytes)
+
+    def checkout(self, path):
+        """return an open Repo for path, reserved for the caller"""
+        path = path.encode('utf8') if isinstance(path, unicode) else path
+        with self._lock:
+            repo = self._idle.pop(path)
+            if repo is not None:
+                return repo
+            self._make_room()
+            self._open += 1
+            repo = self._dormant.pop(path)
+        try:
+            if repo is None:
+                repo = self._repo_class(path, **self._repo_kwargs)
+            repo.open()
+        except:
+            with self._lock:
+                self._open -= 1
+                self._lock.notify()
+            raise
+        return repo
+
+    def checkin(self, repo):
+        """return a Repo obtained from checkout to the pool"""
+        with self._lock:
+            self._idle.push(repo.path, repo)
+            self._lock.notify()
+
+    @contextmanager
+    def repo(self, path):
+        """check out a Repo for the duration of a with block"""
+        repo = self.checkout(path)
+        try:
+            yield repo
+        finally:
+            self.checkin(repo)
+
+    def close(self):
+        """close every idle and dormant repository in the pool
+
+        Repos that are still checked out are left alone.
+        """
+        with self._lock:
+            for repo in self._idle.clear():
+                repo.close()
+                self._open -= 1
+            self._dormant.clear()
+            self._lock.notify_all()
+
+    @property
+    def stats(self):
+        """counts of open, idle, and dormant repositories"""
+        with self._lock:
+            return {
+                'open': self._open,
+                'idle': len(self._idle),
+                'dormant': len(self._dormant),
+                'dormant_bytes': self._dormant.bytes,
+            }
+
+    def _make_room(self):
+        # Caller holds the lock
+        while self._open >= self.max_open:
+            repo = self._idle.pop_oldest()
+            if repo is None:
+                self._lock.wait()
+                continue
+            repo.close()
+            self._open -= 1
+            self._dormant.push(repo.path, repo)
+        if self.cache_bytes is not None:
+            while len(self._dormant) and self._dormant.bytes > self.cache_bytes:
+                self._dormant.pop_oldest()
+
+
+def _cache_bytes(repo):
+    return sum(stats.get('bytes', 0) for stats in repo.cache_stats.values() if stats)
+
+
+class _LRUSet(object):
+    """repositories grouped by path, remembering which was used least recently
+
+    If weigh is given, bytes keeps a running total of weigh(repo), taken as
+    each repo is pushed.
+    """
+
+    def __init__(self, weigh=None):
+        self._order = OrderedDict()
+        self._paths = {}
+        self._weigh = weigh
+        self._weights = {}
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self._order)
+
+    def push(self, path, repo):
+        self._order[id(repo)] = repo
+        self._paths.setdefault(path, []).append(repo)
+        if self._weigh is not None:
+            weight = self._weights[id(repo)] = self._weigh(repo)
+            self.bytes += weight
+
+    def pop(self, path):
+        repos = self._paths.get(path)
+        if not repos:
+            return None
+        repo = repos.pop()
+        if not repos:
+            del self._paths[path]
+        del self._order[id(repo)]
+        self._forget(repo)
+        return repo
+
+    def pop_oldest(self):
+        if not self._order:
+            return None
+        repo = self._order.popitem(last=False)[1]
+        repos = self._paths[repo.path]
+        repos.remove(repo)
+        if not repos:
+            del self._paths[repo.path]
+        self._forget(repo)
+        return repo
+
+    def clear(self):
+        repos = self._order.values()
+        self._order.clear()
+        self._paths.clear()
+        self._weights.clear()
+        self.bytes = 0
+        return repos
+
+    def _forget(self, repo):
+        self.bytes -= self._weights.pop(id(repo), 0)
@@ -0,0 +1,381 @@
+from collections import deque
+import fnmatch
+import os
+import sqlite3
+import threading
+
+from .core import lib, ffi
+from . import error, util
+
+# How many refs an iterator pulls from the store at a time
+_BATCH = 256
+_WILDCARDS = '*?['
+
+
+class RefdbBackend(object):
+    """a ref store plugged into libgit2 in place of loose refs and packed-refs
+
+    Subclasses provide the storage by implementing get, put, remove, and
+    scan; this class wires them into libgit2, so everything that touches
+    refs--ReferenceDb, rev resolution, Walker--goes through them without
+    knowing the difference.  A ref's value is a (target, symbolic) pair:
+    the SHA of a direct ref and None, or None and the name of the ref a
+    symbolic ref points at.
+
+    Stores should keep refs sorted by name, so that lookups and
+    iterating over every ref under a prefix (which is how ReferenceDb
+    lists branches and tags) don't have to touch the rest.
+
+    You will usually attach one with Repo.use_refdb.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._iterators = {}
+        self._backend = ffi.new('git_refdb_backend *')
+        self._callbacks = self._make_callbacks()
+        self._backend.version = lib.GIT_REFDB_BACKEND_VERSION
+        for name in ('exists', 'lookup', 'iterator', 'write', 'rename', 'delete', 'compress', 'free'):
+            setattr(self._backend, name, self._callbacks[name])
+
+    def get(self, name):
+        """return the (target, symbolic) value of a ref, or None"""
+        raise NotImplementedError
+
+    def put(self, name, target, symbolic):
+        """create or overwrite a ref"""
+        raise NotImplementedError
+
+    def put_many(self, refs):
+        """create or overwrite every (name, target, symbolic) in refs"""
+        for name, target, symbolic in refs:
+            self.put(name, target, symbolic)
+
+    def remove(self, name):
+        """remove a ref, returning whether it existed"""
+        raise NotImplementedError
+
+    def move(self, old_name, new_name):
+        """rename a ref, replacing any ref already at new_name"""
+        with self._lock:
+            target, symbolic = self.get(old_name)
+            self.put(new_name, target, symbolic)
+            self.remove(old_name)
+
+    def scan(self, prefix, after, limit):
+        """return up to limit (name, target, symbolic) tuples, sorted by name
+
+        Only refs whose names start with prefix and, unless after is None,
+        sort after it are returned.
+        """
+        raise NotImplementedError
+
+    def count(self, prefix=''):
+        """return how many refs there are under prefix
+
+        This walks every matching ref; stores that can count more cheaply
+        should override it.
+        """
+        return sum(1 for ref in self.iterrefs(prefix))
+
+    def stamp(self):
+        """a value that changes whenever the stored refs may have, or None"""
+        return None
+
+    def close(self):
+        pass
+
+    def iterrefs(self, prefix=''):
+        """iterate over every (name, target, symbolic) under prefix, in name order"""
+        after = None
+        while True:
+            batch = self.scan(prefix, after, _BATCH)
+            for ref in batch:
+                yield ref
+            if len(batch) < _BATCH:
+                return
+            after = batch[-1][0]
+
+    def import_refs(self, repo):
+        """copy HEAD and every ref from a repository's current refdb into this store"""
+        self.put_many(_existing_refs(repo))
+
+    def attach(self, repo):
+        """make this store the repository's refdb"""
+        refdb = ffi.new('git_refdb **')
+        if lib.git_repository_refdb(refdb, repo.pointer):
+            raise error.GitException
+        refdb = refdb[0]
+        try:
+            if lib.git_refdb_set_backend(refdb, self._backend):
+                raise error.GitException
+        finally:
+            lib.git_refdb_free(refdb)
+
+    def _make_callbacks(self):
+        # The C structs hold raw pointers to these, so they're kept alive
+        # for as long as this object is
+
+        @ffi.callback('int(int *, git_refdb_backend *, const char *)', error=lib.GIT_ERROR)
+        def exists(out, backend, name):
+            out[0] = int(self.get(ffi.string(name)) is not None)
+            return 0
+
+        @ffi.callback('int(git_reference **, git_refdb_backend *, const char *)', error=lib.GIT_ERROR)
+        def lookup(out, backend, name):
+            name = ffi.string(name)
+            value = self.get(name)
+            if value is None:
+                return lib.GIT_ENOTFOUND
+            out[0] = _new_reference(name, *value)
+            return 0
+
+        @ffi.callback('int(git_reference_iterator **, git_refdb_backend *, const char *)', error=lib.GIT_ERROR)
+        def iterator(out, backend, glob):
+            it = ffi.new('git_reference_iterator *')
+            it.next = next_ref
+            it.next_name = next_name
+            it.free = free_iterator
+            self._iterators[_address(it)] = (it, _RefIterator(self, ffi.string(glob) if glob else None))
+            out[0] = it
+            return 0
+
+        @ffi.callback('int(git_reference **, git_reference_iterator *)', error=lib.GIT_ERROR)
+        def next_ref(out, it):
+            ref = self._iterators[_address(it)][1].next()
+            if ref is None:
+                return lib.GIT_ITEROVER
+            out[0] = _new_reference(*ref)
+            return 0
+
+        @ffi.callback('int(const char **, git_reference_iterator *)', error=lib.GIT_ERROR)
+        def next_name(out, it):
+            state = self._iterators[_address(it)][1]
+            ref = state.next()
+            if ref is None:
+                return lib.GIT_ITEROVER
+            # libgit2 only borrows the name, until the next call
+            state.name = ffi.new('char[]', ref[0])
+            out[0] = state.name
+            return 0
+
+        @ffi.callback('void(git_reference_iterator *)')
+        def free_iterator(it):
+            self._iterators.pop(_address(it), None)
+
+        @ffi.callback('int(git_refdb_backend *, const git_reference *, int)', error=lib.GIT_ERROR)
+        def write(backend, ref, force):
+            name = ffi.string(lib.git_reference_name(ref))
+            with self._lock:
+                if not force and self.get(name) is not None:
+                    return lib.GIT_EEXISTS
+                self.put(name, *_reference_value(ref))
+            return 0
+
+        @ffi.callback('int(git_reference **, git_refdb_backend *, const char *, const char *, int)',
+                      error=lib.GIT_ERROR)
+        def rename(out, backend, old_name, new_name, force):
+            old_name = ffi.string(old_name)
+            new_name = ffi.string(new_name)
+            with self._lock:
+                value = self.get(old_name)
+                if value is None:
+                    return lib.GIT_ENOTFOUND
+                if not force and self.get(new_name) is not None:
+                    return lib.GIT_EEXISTS
+                self.move(old_name, new_name)
+            out[0] = _new_reference(new_name, *value)
+            return 0
+
+        @ffi.callback('int(git_refdb_backend *, const char *)', error=lib.GIT_ERROR)
+        def delete(backend, name):
+            if not self.remove(ffi.string(name)):
+                return lib.GIT_ENOTFOUND
+            return 0
+
+        @ffi.callback('int(git_refdb_backend *)', error=lib.GIT_ERROR)
+        def compress(backend):
+            # Nothing is ever loose
+            return 0
+
+        @ffi.callback('void(git_refdb_backend *)')
+        def free(backend):
+            # The refdb is going away with the repository; the store itself
+            # stays usable, to be attached again if it's reopened
+            pass
+
+        return {
+            'exists': exists,
+            'lookup': lookup,
+            'iterator': iterator,
+            'next_ref': next_ref,
+            'next_name': next_name,
+            'free_iterator': free_iterator,
+            'write': write,
+            'rename': rename,
+            'delete': delete,
+            'compress': compress,
+            'free': free,
+        }
+
+
+class SqliteRefdb(RefdbBackend):
+    """a RefdbBackend that keeps refs in a SQLite database
+
+    Refs are indexed by name, so lookups take O(log n) and listing the
+    refs under a prefix only visits those refs, however many millions
+    there are in total.  Every change is committed as it's made.
+
+    Once a repository's refs live here, tools that read refs straight off
+    disk (including the git command line) no longer see them.
+    """
+
+    def __init__(self, path):
+        super(SqliteRefdb, self).__init__()
+        self.path = path
+        # libgit2 calls back on whichever thread is using the repo, and
+        # RepoPool hands repos between threads; self._lock serializes use
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.text_factory = str
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS refs '
+                             '(name TEXT PRIMARY KEY, target BLOB, symbolic TEXT)')
+
+    def get(self, name):
+        with self._lock:
+            row = self._db.execute('SELECT target, symbolic FROM refs WHERE name = ?', (name,)).fetchone()
+        return _from_row(row) if row else None
+
+    def put(self, name, target, symbolic):
+        self.put_many([(name, target, symbolic)])
+
+    def put_many(self, refs):
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO refs (name, target, symbolic) VALUES (?, ?, ?)',
+                                 (_to_row(name, target, symbolic) for name, target, symbolic in refs))
+
+    def remove(self, name):
+        with self._lock, self._db:
+            return self._db.execute('DELETE FROM refs WHERE name = ?', (name,)).rowcount > 0
+
+    def move(self, old_name, new_name):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM refs WHERE name = ?', (new_name,))
+            self._db.execute('UPDATE refs SET name = ? WHERE name = ?', (new_name, old_name))
+
+    def scan(self, prefix, after, limit):
+        # Every name under prefix sorts between prefix and prefix + '\xff'
+        if after is not None and after >= prefix:
+            query = 'SELECT name, target, symbolic FROM refs WHERE name > ? AND name < ? ORDER BY name LIMIT ?'
+            args = (after, prefix + '\xff', limit)
+        else:
+            query = 'SELECT name, target, symbolic FROM refs WHERE name >= ? AND name < ? ORDER BY name LIMIT ?'
+            args = (prefix, prefix + '\xff', limit)
+        with self._lock:
+            rows = self._db.execute(query, args).fetchall()
+        return [(name,) + _from_row((target, symbolic)) for name, target, symbolic in rows]
+
+    def count(self, prefix=''):
+        """return how many refs there are under prefix"""
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM refs WHERE name >= ? AND name < ?',
+                                    (prefix, prefix + '\xff')).fetchone()[0]
+
+    def stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class _RefIterator(object):
+    """walks a store's refs in batches, filtering them by a glob"""
+
+    def __init__(self, store, glob):
+        self._store = store
+        self._glob = glob
+        # Only the part of the glob before any wildcard narrows the scan
+        self._prefix = ''
+        if glob is not None:
+            cut = min([glob.index(c) for c in _WILDCARDS if c in glob] or [len(glob)])
+            self._prefix = glob[:cut]
+        self._after = None
+        self._batch = deque()
+        self._done = False
+        self.name = None
+
+    def next(self):
+        while True:
+            if not self._batch:
+                if self._done:
+                    return None
+                self._batch.extend(self._store.scan(self._prefix, self._after, _BATCH))
+                self._done = len(self._batch) < _BATCH
+                if not self._batch:
+                    return None
+            ref = self._batch.popleft()
+            self._after = ref[0]
+            if self._glob is None or fnmatch.fnmatchcase(ref[0], self._glob):
+                return ref
+
+
+def _existing_refs(repo):
+    head = ffi.new('git_reference **')
+    if not lib.git_reference_lookup(head, repo.pointer, 'HEAD'):
+        try:
+            yield ('HEAD',) + _reference_value(head[0])
+        finally:
+            lib.git_reference_free(head[0])
+    iterator = ffi.new('git_reference_iterator **')
+    if lib.git_reference_iterator_new(iterator, repo.pointer):
+        raise error.GitException
+    iterator = iterator[0]
+    try:
+        while True:
+            ref = ffi.new('git_reference **')
+            err = lib.git_reference_next(ref, iterator)
+            if err == lib.GIT_ITEROVER:
+                return
+            if err:
+                raise error.GitException
+            try:
+                yield (ffi.string(lib.git_reference_name(ref[0])),) + _reference_value(ref[0])
+            finally:
+                lib.git_reference_free(ref[0])
+    finally:
+        lib.git_reference_iterator_free(iterator)
+
+
+def _reference_value(ref):
+    if lib.git_reference_type(ref) == lib.GIT_REF_SYMBOLIC:
+        return None, ffi.string(lib.git_reference_symbolic_target(ref))
+    return util.sha(lib.git_reference_target(ref)), None
+
+
+def _new_reference(name, target, symbolic):
+    if symbolic is not None:
+        ref = lib.git_reference__alloc_symbolic(name, symbolic)
+    else:
+        ref = lib.git_reference__alloc(name, util.oid(target), ffi.NULL)
+    if ref == ffi.NULL:
+        raise MemoryError
+    return ref
+
+
+def _address(pointer):
+    return int(ffi.cast('uintptr_t', pointer))
+
+
+def _to_row(name, target, symbolic):
+    # Stored raw, which halves the size of millions of SHAs
+    return name, sqlite3.Binary(util.raw_from_sha(target)) if target is not None else None, symbolic
+
+
+def _from_row(row):
+    target, symbolic = row
+    return (util.hexlify(str(target)) if target is not None else None), symbolic
@@ -1,8 +1,18 @@
+from contextlib import contextmanager
 from os.path import join as pathjoin
+import os
+import time
+import weakref
 
+from .cache import DiskCache, LRUCache, TieredCache
 from .core import lib, ffi
-from .objects import Blob, Commit, Config, Oid, _Oid, Raw, ReferenceDb, Walker
-from . import error
+from .graph import CommitGraph
+from .history import PathHistory
+from .objects import Blob, Commit, Config, MergeResult, ObjectHeader, Oid, _Oid, Raw, ReferenceDb, Walker
+from .odb import MemoryOdb
+from .pack import Transaction, ingest_pack, write_pack
+from .parallel import map_commits
+from . import error, util
 
 
 class RepoNotFoundException(Exception):
@@ -12,6 +22,59 @@ class RepoNotFoundException(Exception):
 
 _HEX = frozenset('abcdef0123456789')
 
+# How many SHAs Repo remembers as known to be in the ODB, to spare
+# Tree.write from re-verifying them
+_KNOWN_OBJECTS = 100000
+
+# How many resolved revisions Repo remembers between ref changes
+_RESOLVED_REVS = 10000
+
+# Worker handles see any given commit about once, so when a repository's
+# own caches are unbounded, its workers' caches are kept small instead
+_WORKER_CACHE_ENTRIES = 1024
+
+# How often, in seconds, Repo restats nested directories of loose refs
+# (such as refs/pull/<n>/) to notice changes made by other processes
+_REFS_RESCAN = 1.0
+
+# Rough per-object overheads used to estimate cache footprints.  These
+# don't need to be exact; they just need to keep caches within an order
+# of magnitude of the budget they were given.
+_COMMIT_OVERHEAD = 1024
+_TREE_ENTRY_OVERHEAD = 256
+
+
+def _commit_size(commit):
+    return _COMMIT_OVERHEAD + len(commit._message or '')
+
+
+def _tree_size(entry):
+    # Don't force lazily-loaded directories to load just to size them
+    if not getattr(entry.children, 'loaded', True):
+        return _TREE_ENTRY_OVERHEAD
+    return _TREE_ENTRY_OVERHEAD * (1 + len(entry.children))
+
+
+def _listing_size(listing):
+    return _TREE_ENTRY_OVERHEAD * (1 + len(listing))
+
+
+def _diff_size(changes):
+    size = _TREE_ENTRY_OVERHEAD * (1 + len(changes))
+    for change in changes.itervalues():
+        # Hunks carry the patch text itself, which dwarfs everything else
+        for hunk in getattr(change, 'hunks', None) or ():
+            size += len(hunk.header) + sum(len(line.content) for line in hunk.lines)
+    return size
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime)
+
 
 class Repo(object):
     """represents a bare or full Git repository
@@ -21,14 +84,47 @@ class Repo(object):
     themselve correctly on CPython via ref counting if they
     are not.  Do note that you at must call .open() if you are
     not using the object in a with block, however.
+
+    Commits, trees, tree diffs, and last-modified listings are cached
+    per repository.  By default these caches are unbounded; pass
+    cache_entries and/or cache_bytes (or call set_cache_budget later) to
+    bound them, or hand in your own commit_cache and tree_cache objects
+    entirely.  Because diffs between two trees never change, they can
+    also be persisted to diff_cache_dir and shared between processes.
+
+    If lazy_trees is set, commit trees load one directory level at a
+    time rather than realizing their whole manifest on first access.
     """
 
-    def __init__(self, path):
+    def __init__(self, path, cache_entries=None, cache_bytes=None,
+                 commit_cache=None, tree_cache=None, lazy_trees=False,
+                 diff_cache_dir=None):
         self._path = path.encode('utf8') if isinstance(path, unicode) else path
+        self.lazy_trees = lazy_trees
         self._repo = None
         self._walker = None
-        self._tree_cache = {}
-        self._commit_cache = {}
+        self._odb = None
+        self._commit_graph = None
+        self._graph_stale = True
+        self._transaction = None
+        self._memory_odb = None
+        self._refdb = None
+        self._known_objects = LRUCache(_KNOWN_OBJECTS)
+        self._revs = LRUCache(_RESOLVED_REVS)
+        self._refs_stamp = None
+        self._nested_refs_stamp = None
+        self._refs_scanned = 0
+        self._top_ref_dirs = None
+        self._nested_ref_dirs = None
+        self._oids = weakref.WeakValueDictionary()
+        self._tree_cache = tree_cache if tree_cache is not None else LRUCache(
+            cache_entries, cache_bytes, sizeof=_tree_size)
+        self._commit_cache = commit_cache if commit_cache is not None else LRUCache(
+            cache_entries, cache_bytes, sizeof=_commit_size)
+        self._last_modified_cache = LRUCache(cache_entries, cache_bytes, sizeof=_listing_size)
+        self._diff_cache = LRUCache(cache_entries, cache_bytes, sizeof=_diff_size)
+        if diff_cache_dir is not None:
+            self._diff_cache = TieredCache(self._diff_cache, DiskCache(diff_cache_dir))
 
     def __del__(self):
         self.close()
@@ -55,7 +151,11 @@ class Repo(object):
             return False
 
     def __getitem__(self, rev):
-        """returns a reified commit object by SHA, ref, or tag
+        """returns a reified commit object by SHA, ref, tag, or rev expression
+
+        Rev expressions such as HEAD~3 are resolved as by git rev-parse,
+        and tags are peeled to the commits they point at.  Resolved revs
+        are cached until the repository's refs change on disk.
 
         Throws a KeyError if the ref or tag cannot be resolved, or
         if the provided SHA does not exist.
@@ -84,12 +184,7 @@ class Repo(object):
                         alternates.write('\n')
                 alternates.write(path)
                 alternates.write('\n')
-        odb = ffi.new('git_odb **')
-        if lib.git_repository_odb(odb, self._repo):
-            raise error.GitException
-        odb = odb[0]
-        lib.git_odb_add_disk_alternate(odb, path)
-        lib.git_odb_free(odb)
+        lib.git_odb_add_disk_alternate(self.odb_pointer, path)
         return True
 
     def get_alternates(self):
@@ -121,9 +216,55 @@ class Repo(object):
         Note that ref and tag lookup is not performed here; use the
         generic __getattr__ behavior on this object for that.
         """
-        if oid not in self._commit_cache:
-            self._commit_cache[oid] = Commit(self, oid)
-        return self._commit_cache[oid]
+        commit = self._commit_cache.get(oid)
+        if commit is None:
+            commit = self._commit_cache[oid] = Commit(self, oid)
+        return commit
+
+    def commits(self, shas, fields=None):
+        """return a list of commits for the given SHAs or OIDs, in order
+
+        If fields is given, only that subset of Commit.FIELDS is loaded
+        for each commit (for example, ['parents', 'commit_time'] for
+        graph work); anything else loads on first access.  Throws a
+        KeyError if any commit does not exist.
+        """
+        cache = self._commit_cache
+        commits = []
+        for oid in shas:
+            commit = cache.get(oid)
+            if commit is None:
+                commit = Commit(self, oid, load=False)
+                commit.read(fields)
+                cache[oid] = commit
+            else:
+                commit.read(fields)
+            commits.append(commit)
+        return commits
+
+    @property
+    def cache_stats(self):
+        """hit, miss, and eviction counters for this repository's caches
+
+        Caches that don't keep statistics are reported as None.
+        """
+        return {
+            'commits': getattr(self._commit_cache, 'stats', None),
+            'trees': getattr(self._tree_cache, 'stats', None),
+            'last_modified': self._last_modified_cache.stats,
+            'diffs': self._diff_cache.stats,
+        }
+
+    def set_cache_budget(self, max_entries=None, max_bytes=None):
+        """bound this repository's commit and tree caches
+
+        Each cache gets the full budget; byte counts are estimates, not
+        exact measurements.  Caches that don't support resizing are left
+        alone.
+        """
+        for cache in (self._commit_cache, self._tree_cache, self._last_modified_cache, self._diff_cache):
+            if hasattr(cache, 'resize'):
+                cache.resize(max_entries, max_bytes)
 
     def contains_object(self, sha):
         """checks whether the repo contains a given SHA, regardless of type
@@ -132,13 +273,153 @@ class Repo(object):
         check for other methods that are part of pyggy, to ensure that corrupt
         data is not written.
         """
-        odb = ffi.new('git_odb **')
-        if lib.git_repository_odb(odb, self._repo):
-            raise error.GitException
-        odb = odb[0]
-        contains = lib.git_odb_exists(odb, Oid(sha).pointer) != 0
-        lib.git_odb_free(odb)
-        return contains
+        if self._transaction is not None and sha in self._transaction:
+            return True
+        return lib.git_odb_exists(self.odb_pointer, Oid(sha).pointer) != 0
+
+    def contains_objects(self, shas):
+        """checks a batch of SHAs against the repo, returning the set of missing ones
+
+        Like contains_object, this is mostly meant for pyggy's own sanity
+        checks.  SHAs already known to be in the ODB are not looked up again.
+        """
+        odb = self.odb_pointer
+        known = self._known_objects
+        pending = self._transaction
+        missing = set()
+        for sha in shas:
+            key = str(sha)
+            if key in known or (pending is not None and key in pending):
+                continue
+            if lib.git_odb_exists(odb, Oid(sha).pointer):
+                known[key] = True
+            else:
+                missing.add(sha)
+        return missing
+
+    def pack(self, out, include=[], exclude=[], threads=None, progress=None):
+        """build a pack of a revision range, streaming it to a file-like object
+
+        The pack holds the commits in the range (as for Walker.open) and
+        every tree and blob they introduce, so it's suitable for sending
+        to a repository that already has exclude.  See
+        pyggy.pack.write_pack for threads and progress.  Returns a
+        PackStats.
+        """
+        return write_pack(self, out, include=include, exclude=exclude, threads=threads, progress=progress)
+
+    def ingest_pack(self, fileobj, chunk_size=1 << 20, progress=None):
+        """index a pack stream, such as one written by Repo.pack, into this repository
+
+        See pyggy.pack.ingest_pack for chunk_size and progress.  Returns
+        the name of the new pack.
+        """
+        return ingest_pack(self, fileobj, chunk_size=chunk_size, progress=progress)
+
+    def use_memory_odb(self, max_bytes=None):
+        """hold newly written objects in memory instead of on disk
+
+        Layers a MemoryOdb with a budget of max_bytes over the on-disk
+        object store (or updates the budget of the one already attached)
+        and returns it.  Use its flush() and discard() methods to keep or
+        drop what's been written since.
+        """
+        if self._memory_odb is None:
+            self._memory_odb = MemoryOdb(self, max_bytes)
+        else:
+            self._memory_odb.max_bytes = max_bytes
+            self._memory_odb.enabled = True
+        self._memory_odb.attach()
+        return self._memory_odb
+
+    def use_refdb(self, refdb, import_refs=True):
+        """keep this repository's refs in a RefdbBackend instead of on disk
+
+        Unless import_refs is False, HEAD and every existing ref are
+        copied into refdb first.  From then on every ref read or write
+        made through this Repo--ReferenceDb, rev resolution, walks--goes
+        to refdb, including after the repository is closed and reopened.
+        """
+        if import_refs:
+            refdb.import_refs(self)
+        refdb.attach(self)
+        self._refdb = refdb
+        self._refs_changed()
+
+    @property
+    def refdb(self):
+        """the RefdbBackend attached by use_refdb, if any"""
+        return self._refdb
+
+    @property
+    def memory_odb(self):
+        """the MemoryOdb attached by use_memory_odb, if any"""
+        return self._memory_odb
+
+    @contextmanager
+    def transaction(self):
+        """write every object created in a with block as a single pack
+
+        Blobs, trees, and commits written inside the block are buffered
+        in a Transaction and land in the ODB as one indexed pack when the
+        block exits, rather than as one loose object each.  If the block
+        raises, nothing is written.  Refs should only be pointed at the
+        new objects once the block has exited.
+        """
+        if self._transaction is not None:
+            raise ValueError('a transaction is already in progress')
+        transaction = self._transaction = Transaction(self)
+        try:
+            yield transaction
+            self._transaction = None
+            transaction.commit()
+        finally:
+            self._transaction = None
+            transaction.rollback()
+
+    def history(self, paths, include=[], exclude=[], limit=None):
+        """iterate over the Oids of commits that changed any of the given paths
+
+        This behaves like git log -- <paths>: include and exclude work as
+        they do for Walker.open (defaulting to all branches), and merges
+        are simplified the same way git simplifies them by default.
+        See PathHistory for details.
+        """
+        return iter(PathHistory(self, paths, include, exclude, limit))
+
+    def object_header(self, sha):
+        """return the ObjectHeader (type and size) for a given SHA or OID
+
+        Only the object's header is read from the ODB, so this is much
+        cheaper than loading the object when all you need is its size or
+        type.  Throws a KeyError if the object does not exist.
+        """
+        headers = self.object_headers([sha])
+        if not headers:
+            raise KeyError(str(sha))
+        return headers.values()[0]
+
+    def object_headers(self, shas):
+        """return a dict mapping each given SHA or OID to its ObjectHeader
+
+        This is the batch form of object_header.  Objects that do not exist
+        are left out of the result rather than raising.
+        """
+        odb = self.odb_pointer
+        size = ffi.new('size_t *')
+        otype = ffi.new('git_otype *')
+        type_names = {}
+        headers = {}
+        for sha in shas:
+            err = lib.git_odb_read_header(size, otype, odb, Oid(sha).pointer)
+            if err:
+                if err == lib.GIT_ENOTFOUND:
+                    continue
+                raise error.GitException
+            if otype[0] not in type_names:
+                type_names[otype[0]] = ffi.string(lib.git_object_type2string(otype[0]))
+            headers[sha] = ObjectHeader(type_names[otype[0]], size[0])
+        return headers
 
     def create(self, bare=False):
         """create the repository on disk
@@ -162,6 +443,12 @@ class Repo(object):
         if getattr(self, '_repo', None):
             if getattr(self, '_walker', None):
                 self._walker.close()
+            if getattr(self, '_commit_graph', None):
+                self._commit_graph.close()
+                self._commit_graph = None
+            if getattr(self, '_odb', None):
+                lib.git_odb_free(self._odb)
+                self._odb = None
             lib.git_repository_free(self._repo)
             self._repo = None
 
@@ -179,6 +466,157 @@ class Repo(object):
                 raise RepoNotFoundException(self.path)
             raise error.GitException
         self._repo = repo[0]
+        if self._memory_odb is not None:
+            self._memory_odb.attach()
+        if self._refdb is not None:
+            self._refdb.attach(self)
+
+    def map_commits(self, fn, include=[], exclude=[], limit=None, workers=None,
+                    backend='thread', ordered=True, chunksize=None, cache_entries=None,
+                    cache_bytes=None):
+        """apply fn to each commit in a revision range on a pool of workers
+
+        Returns an iterator over fn's results.  include, exclude, and limit
+        work as they do for Walker.open; workers defaults to the number of
+        CPUs; backend is 'thread' or 'process'.  Each worker uses its own
+        handle on this repository, with caches bounded by cache_entries and
+        cache_bytes, or by this repository's own commit cache bounds if
+        neither is given.  See pyggy.parallel.map_commits.
+        """
+        return map_commits(self, fn, include=include, exclude=exclude, limit=limit,
+                           workers=workers, backend=backend, ordered=ordered,
+                           chunksize=chunksize, cache_entries=cache_entries,
+                           cache_bytes=cache_bytes)
+
+    def merge_base(self, one, two):
+        """return the Oid of the best common ancestor of two commits
+
+        Returns None if the commits share no history.  Throws a KeyError if
+        either commit does not exist.
+        """
+        self._require_objects([one, two])
+        out = ffi.new('git_oid *')
+        err = lib.git_merge_base(out, self._repo, Oid(one).pointer, Oid(two).pointer)
+        if err:
+            if err == lib.GIT_ENOTFOUND:
+                return None
+            raise error.GitException
+        return self.oid(out)
+
+    def merge_base_many(self, shas):
+        """return the Oid of the best common ancestor of several commits
+
+        Returns None if the commits share no history.  Throws a KeyError if
+        any commit does not exist.
+        """
+        shas = list(shas)
+        self._require_objects(shas)
+        oids = ffi.new('git_oid[]', len(shas))
+        for idx, sha in enumerate(shas):
+            lib.git_oid_cpy(ffi.addressof(oids, idx), Oid(sha).pointer)
+        out = ffi.new('git_oid *')
+        err = lib.git_merge_base_many(out, self._repo, oids, len(shas))
+        if err:
+            if err == lib.GIT_ENOTFOUND:
+                return None
+            raise error.GitException
+        return self.oid(out)
+
+    def merge_check(self, ours, theirs):
+        """merge two commits in memory, returning a MergeResult
+
+        Nothing is checked out and nothing is written; this only reports
+        the merge base and which paths would conflict.
+        """
+        return self.merge_checks([(ours, theirs)])[0]
+
+    def merge_checks(self, pairs):
+        """merge many (ours, theirs) commit pairs in memory
+
+        This is the batch form of merge_check.  Merge bases and trees are
+        computed once per distinct commit (or pair) and shared across the
+        whole batch, so checking many heads against a few bases is cheap.
+        """
+        bases = {}
+        trees = {}
+
+        def tree(sha):
+            if sha not in trees:
+                commit = ffi.new('git_commit **')
+                if lib.git_commit_lookup(commit, self._repo, Oid(sha).pointer):
+                    raise error.GitException
+                commit = commit[0]
+                try:
+                    out = ffi.new('git_tree **')
+                    if lib.git_commit_tree(out, commit):
+                        raise error.GitException
+                    trees[sha] = out[0]
+                finally:
+                    lib.git_commit_free(commit)
+            return trees[sha]
+
+        results = []
+        try:
+            for ours, theirs in pairs:
+                ours, theirs = self.oid(ours), self.oid(theirs)
+                key = frozenset([ours, theirs])
+                if key not in bases:
+                    bases[key] = self.merge_base(ours, theirs)
+                base = bases[key]
+                ancestor = tree(base) if base is not None else ffi.NULL
+                conflicts = self._merge_conflicts(ancestor, tree(ours), tree(theirs))
+                results.append(MergeResult(base, conflicts))
+        finally:
+            for t in trees.itervalues():
+                lib.git_tree_free(t)
+        return results
+
+    def _worker_kwargs(self, cache_entries=None, cache_bytes=None):
+        # Constructor arguments for a worker's own handle on this repo,
+        # bounded by the given budget or else by this repo's commit cache
+        if cache_entries is None and cache_bytes is None:
+            cache_entries = getattr(self._commit_cache, 'max_entries', None)
+            cache_bytes = getattr(self._commit_cache, 'max_bytes', None)
+            if cache_entries is None and cache_bytes is None:
+                cache_entries = _WORKER_CACHE_ENTRIES
+        return {'cache_entries': cache_entries, 'cache_bytes': cache_bytes, 'lazy_trees': self.lazy_trees}
+
+    def _require_objects(self, shas):
+        # libgit2 reports a missing input the same way as no merge base
+        missing = self.contains_objects(shas)
+        if missing:
+            raise KeyError(str(next(iter(missing))))
+
+    def _merge_conflicts(self, ancestor, ours, theirs):
+        index = ffi.new('git_index **')
+        if lib.git_merge_trees(index, self._repo, ancestor, ours, theirs, ffi.NULL):
+            raise error.GitException
+        index = index[0]
+        conflicts = set()
+        try:
+            if not lib.git_index_has_conflicts(index):
+                return []
+            iterator = ffi.new('git_index_conflict_iterator **')
+            if lib.git_index_conflict_iterator_new(iterator, index):
+                raise error.GitException
+            iterator = iterator[0]
+            try:
+                entries = [ffi.new('git_index_entry **') for _ in xrange(3)]
+                while True:
+                    err = lib.git_index_conflict_next(entries[0], entries[1], entries[2], iterator)
+                    if err == lib.GIT_ITEROVER:
+                        break
+                    if err:
+                        raise error.GitException
+                    for entry in entries:
+                        if entry[0] != ffi.NULL:
+                            conflicts.add(ffi.string(entry[0].path))
+                            break
+            finally:
+                lib.git_index_conflict_iterator_free(iterator)
+        finally:
+            lib.git_index_free(index)
+        return sorted(conflicts)
 
     def mirror(self, url):
         """make this repository mirror another
@@ -219,7 +657,7 @@ class Repo(object):
 
     @property
     def head(self):
-        return self['HEAD'].oid.sha
+        return self._resolve_rev('HEAD')
 
     @head.setter
     def head(self, branch):
@@ -227,11 +665,30 @@ class Repo(object):
         if lib.git_reference_symbolic_create(ref, self._repo, 'HEAD', branch, 1):
             raise error.GitException
         lib.git_reference_free(ref[0])
+        self._refs_changed()
 
     @property
     def tags(self):
         return ReferenceDb(self, 'refs/tags/')
 
+    @property
+    def commit_graph(self):
+        """the repository's CommitGraph, for fast ancestry queries
+
+        The graph lives in the object store's info directory.  Whenever
+        branches have moved since it was last fetched, any new history is
+        indexed and written out before it's returned, so only the new
+        commits are ever read.
+        """
+        if self._commit_graph is None:
+            self._commit_graph = CommitGraph(self, pathjoin(self.odb_path, 'info', 'pyggy-commit-graph'))
+            self._graph_stale = True
+        self._check_refs()
+        if self._graph_stale:
+            self._commit_graph.update()
+            self._graph_stale = False
+        return self._commit_graph
+
     @property
     def config(self):
         return Config(self)
@@ -254,6 +711,21 @@ class Repo(object):
         else:
             return pathjoin(self.path, '.git', 'objects')
 
+    @property
+    def odb_pointer(self):
+        """the underlying C pointer for this repository's object store
+
+        The handle is opened on first use and held until the repository is
+        closed.  As with Repo.pointer, you should never call this unless you
+        are writing part of pyggy itself.
+        """
+        if self._odb is None:
+            odb = ffi.new('git_odb **')
+            if lib.git_repository_odb(odb, self._repo):
+                raise error.GitException
+            self._odb = odb[0]
+        return self._odb
+
     @property
     def walker(self):
         """the repository's default walker
@@ -271,6 +743,33 @@ class Repo(object):
         """return the path to the main repository on disk"""
         return self._path
 
+    def oid(self, oid):
+        """return the interned Oid for a SHA, Oid, or C git_oid
+
+        Interned Oids are shared for as long as anything holds onto them,
+        so walks and manifests that see the same object many times don't
+        allocate a new Oid for each sighting.  Abbreviated SHAs are not
+        interned.
+        """
+        if isinstance(oid, _Oid):
+            if len(oid) != lib.GIT_OID_HEXSZ:
+                return oid
+            raw = oid.raw
+        elif isinstance(oid, basestring):
+            if len(oid) != lib.GIT_OID_HEXSZ:
+                return Oid(oid)
+            raw = util.raw_from_sha(str(oid))
+        else:
+            raw = util.raw(oid)
+        return self._intern(raw, oid if isinstance(oid, _Oid) else None)
+
+    def _intern(self, raw, oid=None):
+        interned = self._oids.get(raw)
+        if interned is None:
+            interned = oid if oid is not None else _Oid.from_raw(raw)
+            self._oids[raw] = interned
+        return interned
+
     def raw(self, oid):
         """return the raw object for a given OID, without parsing
 
@@ -287,6 +786,15 @@ class Repo(object):
         """
         return self._repo
 
+    def revparse(self, spec):
+        """return the Oid of the object named by a rev expression
+
+        Anything git rev-parse accepts for a single object works, such as
+        HEAD~3, master^2, or v1.0^{tree}.  Throws a KeyError if the
+        expression can't be resolved.
+        """
+        return self.oid(self._revparse(spec, lib.GIT_OBJ_ANY))
+
     def _resolve_rev(self, rev):
         if isinstance(rev, unicode):
             rev = rev.encode('utf8')
@@ -298,19 +806,78 @@ class Repo(object):
                 len(rev) >= lib.GIT_OID_MINPREFIXLEN and
                 all(c in _HEX for c in rev)):
             return rev
-        ref = ffi.new('git_reference **')
-        err = lib.git_reference_dwim(ref, self._repo, rev)
+        return self._revparse(rev, lib.GIT_OBJ_COMMIT)
+
+    def _revparse(self, spec, peel):
+        if isinstance(spec, unicode):
+            spec = spec.encode('utf8')
+        self._check_refs()
+        key = (spec, peel)
+        sha = self._revs.get(key)
+        if sha is None:
+            sha = self._revs[key] = self._lookup_rev(spec, peel)
+        return sha
+
+    def _lookup_rev(self, spec, peel):
+        obj = ffi.new('git_object **')
+        err = lib.git_revparse_single(obj, self._repo, spec)
         if err:
-            if err == lib.GIT_ENOTFOUND:
-                raise KeyError(rev)
-            raise error.GitException
-
-        ref = ref[0]
-        resolved_ref = ffi.new('git_reference **')
-        if lib.git_reference_resolve(resolved_ref, ref):
+            if err in (lib.GIT_ENOTFOUND, lib.GIT_EAMBIGUOUS, lib.GIT_EINVALIDSPEC):
+                raise KeyError(spec)
             raise error.GitException
-        resolved_ref = resolved_ref[0]
-        rev = Oid(lib.git_reference_target(resolved_ref)).sha
-        lib.git_reference_free(ref)
-        lib.git_reference_free(resolved_ref)
-        return rev
+        obj = obj[0]
+        try:
+            if peel != lib.GIT_OBJ_ANY and lib.git_object_type(obj) != peel:
+                peeled = ffi.new('git_object **')
+                err = lib.git_object_peel(peeled, obj, peel)
+                if err:
+                    if err in (lib.GIT_ENOTFOUND, lib.GIT_EAMBIGUOUS, lib.GIT_EINVALIDSPEC):
+                        raise KeyError(spec)
+                    raise error.GitException
+                lib.git_object_free(obj)
+                obj = peeled[0]
+            return util.sha(lib.git_object_id(obj))
+        finally:
+            lib.git_object_free(obj)
+
+    def _check_refs(self):
+        # Resolved revisions stay valid until HEAD, packed-refs, a
+        # directory of loose refs, or an attached refdb's own stamp
+        # changes.  Git updates loose refs by renaming a lock file into
+        # place, so the directory's mtime moves whenever a ref in it does.
+        # Only HEAD, packed-refs, and the top-level directories are
+        # checked on every lookup; there can be thousands of nested ones,
+        # so those are only checked every _REFS_RESCAN seconds.
+        now = time.time()
+        if self._top_ref_dirs is not None and self._stat_refs(self._top_ref_dirs) == self._refs_stamp:
+            if now - self._refs_scanned < _REFS_RESCAN:
+                return
+            self._refs_scanned = now
+            if self._stat_refs(self._nested_ref_dirs) == self._nested_refs_stamp:
+                return
+        self._list_ref_dirs()
+        self._revs.clear()
+        self._graph_stale = True
+        self._refs_stamp = self._stat_refs(self._top_ref_dirs)
+        self._nested_refs_stamp = self._stat_refs(self._nested_ref_dirs)
+        self._refs_scanned = now
+
+    def _list_ref_dirs(self):
+        refs = pathjoin(ffi.string(lib.git_repository_path(self._repo)), 'refs')
+        self._top_ref_dirs = [refs]
+        self._nested_ref_dirs = []
+        for root, dirs, files in os.walk(refs):
+            if root != refs:
+                (self._top_ref_dirs if os.path.dirname(root) == refs else self._nested_ref_dirs).append(root)
+
+    def _stat_refs(self, dirs):
+        git_dir = ffi.string(lib.git_repository_path(self._repo))
+        return tuple([_stat_key(pathjoin(git_dir, 'HEAD')), _stat_key(pathjoin(git_dir, 'packed-refs')),
+                      self._refdb.stamp() if self._refdb is not None else None] +
+                     [_stat_key(path) for path in dirs])
+
+    def _refs_changed(self):
+        # Force the next lookup to restat, in case a ref moved within the
+        # filesystem's mtime granularity
+        self._refs_stamp = None
+        self._graph_stale = True
@@ -1,3 +1,5 @@
+from binascii import hexlify, unhexlify
+
 from .core import lib, ffi
 from . import error
 
@@ -10,8 +12,25 @@ def oid(sha):
 
 
 def sha(oid):
-    sha = ffi.new('char[40]')
-    lib.git_oid_fmt(sha, oid)
-    return ffi.string(sha)
+    return hexlify(ffi.buffer(oid, lib.GIT_OID_RAWSZ)[:])
+
+
+def raw(oid):
+    return ffi.buffer(oid, lib.GIT_OID_RAWSZ)[:]
+
+
+def raw_from_sha(sha):
+    if len(sha) == lib.GIT_OID_HEXSZ:
+        try:
+            return unhexlify(sha)
+        except (TypeError, ValueError):
+            pass
+    return raw(oid(sha))
+
+
+def oid_from_raw(raw):
+    oid = ffi.new('git_oid *')
+    ffi.buffer(oid, lib.GIT_OID_RAWSZ)[:] = raw
+    return oid
 
 propertycache = property
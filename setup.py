@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from distutils.core import setup
+from setuptools import setup
 
 # for CFFI, so that .verify() will be called properly
 from pyggy import core
@@ -13,5 +13,6 @@ setup(name='pyggy',
       ext_package='pyggy',
       ext_modules=[core.ffi.verifier.get_extension()],
       requires=['cffi (==0.6)'],
+      extras_require={'async': ['futures', 'trollius']},
       packages=['pyggy', 'pyggy.headers'],
       package_data={'pyggy.headers': ['*.h']})
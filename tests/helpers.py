@@ -0,0 +1,60 @@
+import shutil
+import tempfile
+import unittest
+
+from pyggy.core import lib
+from pyggy.objects import Blob, Commit, Timestamp, Tree, TreeEntry, User
+from pyggy.repo import Repo
+
+
+class RepoTestCase(unittest.TestCase):
+    """a test case with scratch bare repositories, removed afterwards"""
+
+    def setUp(self):
+        self._repos = []
+        self._dirs = []
+        self.repo = self.make_repo()
+
+    def tearDown(self):
+        for repo in self._repos:
+            repo.close()
+        for path in self._dirs:
+            shutil.rmtree(path)
+
+    def make_repo(self, **kwargs):
+        repo = Repo(self.make_dir(), **kwargs)
+        repo.create(bare=True)
+        self._repos.append(repo)
+        return repo
+
+    def make_dir(self):
+        path = tempfile.mkdtemp()
+        self._dirs.append(path)
+        return path
+
+
+def write_tree(repo, files):
+    """write a tree of {name: data or {name: ...}} and return it"""
+    tree = Tree(repo)
+    for name, value in sorted(files.iteritems()):
+        if isinstance(value, dict):
+            subtree = write_tree(repo, value)
+            tree.add_entry(TreeEntry(name, subtree.sha, lib.GIT_FILEMODE_TREE))
+        else:
+            blob = Blob(repo)
+            blob.data = value
+            blob.write()
+            tree.add_entry(TreeEntry(name, blob.sha, lib.GIT_FILEMODE_BLOB))
+    tree.write()
+    return tree
+
+
+def write_commit(repo, files, parents=(), message='commit\n', when=1380000000):
+    """write a commit of a tree as for write_tree and return its SHA"""
+    commit = Commit(repo)
+    commit.tree = write_tree(repo, files)
+    commit.committer = User('pyggy', 'pyggy@example.com', Timestamp(when, 0))
+    commit.message = message
+    commit.parent_ids = list(parents)
+    commit.write()
+    return commit.sha
@@ -0,0 +1,67 @@
+import unittest
+
+from pyggy.graph import CommitGraph
+from pyggy.repo import Repo
+
+from .helpers import RepoTestCase, write_commit
+
+
+class CommitGraphTest(RepoTestCase):
+    def setUp(self):
+        super(CommitGraphTest, self).setUp()
+        # root - a - b ------ merge
+        #    \               /
+        #     c ------------
+        repo = self.repo
+        self.root = write_commit(repo, {'f': '0\n'}, when=1380000001)
+        self.a = write_commit(repo, {'f': 'a\n'}, [self.root], when=1380000002)
+        self.b = write_commit(repo, {'f': 'b\n'}, [self.a], when=1380000003)
+        self.c = write_commit(repo, {'g': 'c\n'}, [self.root], when=1380000004)
+        self.merge = write_commit(repo, {'f': 'b\n', 'g': 'c\n'}, [self.b, self.c], when=1380000005)
+        repo.branches['refs/heads/master'] = self.b
+        repo.branches['refs/heads/topic'] = self.c
+
+    def test_queries(self):
+        graph = self.repo.commit_graph
+        self.assertEqual(len(graph), 4)
+        self.assertEqual(graph.merge_base(self.b, self.c).sha, self.root)
+        self.assertEqual(graph.merge_base(self.b, self.c), self.repo.merge_base(self.b, self.c))
+        self.assertEqual(graph.ahead_behind(self.b, self.c), (2, 1))
+        self.assertTrue(graph.is_ancestor(self.root, self.b))
+        self.assertFalse(graph.is_ancestor(self.c, self.b))
+        self.assertEqual(graph.generation(self.root), 1)
+        self.assertEqual(graph.generation(self.b), 3)
+        self.assertEqual(graph.commit_time(self.c), 1380000004)
+        self.assertEqual([oid.sha for oid in graph.parents(self.b)], [self.a])
+
+    def test_follows_moved_refs(self):
+        self.assertEqual(len(self.repo.commit_graph), 4)
+        self.repo.branches['refs/heads/master'] = self.merge
+        graph = self.repo.commit_graph
+        self.assertEqual(len(graph), 5)
+        self.assertEqual(graph.generation(self.merge), 4)
+        self.assertEqual(graph.ahead_behind(self.merge, self.c), (3, 0))
+
+    def test_appends_survive_reopening(self):
+        path = self.repo.commit_graph.path
+        self.repo.branches['refs/heads/master'] = self.merge
+        self.repo.commit_graph
+
+        reopened = Repo(self.repo.path)
+        reopened.open()
+        try:
+            # Read the file as written, without letting Repo update it
+            graph = CommitGraph(reopened, path)
+            self.assertEqual(len(graph), 5)
+            for sha in (self.root, self.a, self.b, self.c, self.merge):
+                self.assertIn(sha, graph)
+            self.assertEqual(graph.generation(self.merge), 4)
+            self.assertEqual(sorted(oid.sha for oid in graph.parents(self.merge)), sorted([self.b, self.c]))
+            self.assertEqual(graph.merge_base(self.a, self.c).sha, self.root)
+            graph.close()
+        finally:
+            reopened.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+from os.path import exists, join as pathjoin
+import unittest
+
+from pyggy.objects import Blob
+
+from .helpers import RepoTestCase, write_commit
+
+FILES = {'README': 'hello\n', 'src': {'main.c': 'int main() { return 0; }\n'}}
+
+
+class MemoryOdbTest(RepoTestCase):
+    def loose_path(self, sha):
+        return pathjoin(self.repo.odb_path, sha[:2], sha[2:])
+
+    def write_blob(self, data):
+        blob = Blob(self.repo)
+        blob.data = data
+        blob.write()
+        return blob.sha
+
+    def test_writes_stay_in_memory(self):
+        expected = write_commit(self.make_repo(), FILES)
+        odb = self.repo.use_memory_odb()
+        sha = write_commit(self.repo, FILES)
+        self.assertEqual(sha, expected)
+        self.assertEqual(len(odb), 5)
+        self.assertIn(sha, odb)
+        self.assertFalse(exists(self.loose_path(sha)))
+        readme = self.repo.commit(sha).tree.lookup('README').sha
+        self.assertEqual(self.repo.blob(readme).data, 'hello\n')
+
+    def test_flush_and_discard(self):
+        odb = self.repo.use_memory_odb()
+        kept = self.write_blob('kept\n')
+        odb.flush()
+        self.assertEqual(len(odb), 0)
+        dropped = self.write_blob('dropped\n')
+        odb.discard()
+        self.assertEqual(self.repo.blob(kept).data, 'kept\n')
+        self.assertFalse(self.repo.contains_object(dropped))
+
+    def test_over_budget_writes_spill_to_disk(self):
+        odb = self.repo.use_memory_odb(max_bytes=8)
+        small = self.write_blob('small\n')
+        large = self.write_blob('far too large to hold\n')
+        self.assertIn(small, odb)
+        self.assertNotIn(large, odb)
+        self.assertEqual(odb.stats['spilled'], 1)
+        self.assertTrue(exists(self.loose_path(large)))
+        self.assertEqual(self.repo.blob(large).data, 'far too large to hold\n')
+
+    def test_reattaches_after_reopening(self):
+        odb = self.repo.use_memory_odb()
+        before = self.write_blob('before\n')
+        self.repo.close()
+        self.repo.open()
+        after = self.write_blob('after\n')
+        self.assertIn(before, odb)
+        self.assertIn(after, odb)
+        self.assertEqual(self.repo.blob(before).data, 'before\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
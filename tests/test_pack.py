@@ -0,0 +1,87 @@
+from os.path import exists, join as pathjoin
+import io
+import struct
+import unittest
+
+from pyggy.core import lib
+from pyggy.pack import _object_header
+
+from .helpers import RepoTestCase, write_commit
+
+FILES = {
+    'README': 'hello\n',
+    'src': {'main.c': 'int main() { return 0; }\n'},
+}
+
+
+class ObjectHeaderTest(unittest.TestCase):
+    def test_small_sizes_fit_in_one_byte(self):
+        self.assertEqual(_object_header(lib.GIT_OBJ_BLOB, 10), '\x3a')
+        self.assertEqual(_object_header(lib.GIT_OBJ_TREE, 15), '\x2f')
+
+    def test_larger_sizes_continue_seven_bits_at_a_time(self):
+        self.assertEqual(_object_header(lib.GIT_OBJ_TREE, 16), '\xa0\x01')
+        self.assertEqual(_object_header(lib.GIT_OBJ_COMMIT, 100), '\x94\x06')
+        self.assertEqual(_object_header(lib.GIT_OBJ_BLOB, 1 << 20), '\xb0\x80\x80\x04')
+
+
+class WritePackTest(RepoTestCase):
+    def setUp(self):
+        super(WritePackTest, self).setUp()
+        self.first = write_commit(self.repo, FILES, message='first\n')
+        self.second = write_commit(self.repo, dict(FILES, README='changed\n'), [self.first], message='second\n')
+
+    def test_pack_holds_whole_history(self):
+        out = io.BytesIO()
+        stats = self.repo.pack(out, include=[self.second])
+        data = out.getvalue()
+        # Two commits, two root trees, one src tree, and three blobs
+        self.assertEqual(stats.objects, 8)
+        self.assertEqual(stats.bytes, len(data))
+        self.assertEqual(struct.unpack('>4sII', data[:12]), ('PACK', 2, 8))
+
+    def test_pack_leaves_out_what_exclude_has(self):
+        progress = []
+        out = io.BytesIO()
+        stats = self.repo.pack(out, include=[self.second], exclude=[self.first],
+                               progress=lambda *args: progress.append(args))
+        # The new commit, its root tree, and the changed README
+        self.assertEqual(stats.objects, 3)
+        self.assertIn(('counting', 1, 1), progress)
+        self.assertEqual(progress[-1], ('writing', len(out.getvalue()), None))
+
+
+class IngestPackTest(RepoTestCase):
+    def setUp(self):
+        super(IngestPackTest, self).setUp()
+        self.first = write_commit(self.repo, FILES, message='first\n')
+        self.second = write_commit(self.repo, dict(FILES, README='changed\n'), [self.first], message='second\n')
+        self.other = self.make_repo()
+
+    def ingest(self, **kwargs):
+        out = io.BytesIO()
+        self.repo.pack(out, include=[self.second])
+        out.seek(0)
+        return self.other.ingest_pack(out, **kwargs)
+
+    def test_ingested_objects_are_readable(self):
+        name = self.ingest()
+        self.assertTrue(name.startswith('pack-'))
+        for ext in ('.pack', '.idx'):
+            self.assertTrue(exists(pathjoin(self.other.odb_path, 'pack', name + ext)))
+        commit = self.other.commit(self.second)
+        self.assertEqual(commit.message, 'second\n')
+        self.assertEqual(commit.parent_ids, [self.first])
+        self.assertEqual(self.other.blob(commit.tree.lookup('README').sha).data, 'changed\n')
+
+    def test_small_chunks_and_progress(self):
+        progress = []
+        self.ingest(chunk_size=7, progress=progress.append)
+        self.assertTrue(progress)
+        self.assertEqual(set(p.total_objects for p in progress), set([8]))
+        self.assertTrue(all(p.indexed_objects <= 8 for p in progress))
+        self.assertTrue(self.other.contains_object(self.first))
+
+
+if __name__ == '__main__':
+    unittest.main()
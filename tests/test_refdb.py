@@ -0,0 +1,64 @@
+from os.path import join as pathjoin
+import unittest
+
+from pyggy.refdb import SqliteRefdb
+
+from .helpers import RepoTestCase, write_commit
+
+
+class SqliteRefdbTest(RepoTestCase):
+    def setUp(self):
+        super(SqliteRefdbTest, self).setUp()
+        self.first = write_commit(self.repo, {'f': '1\n'}, message='first\n')
+        self.second = write_commit(self.repo, {'f': '2\n'}, [self.first], message='second\n')
+        self.repo.branches['refs/heads/master'] = self.first
+        self.db_path = pathjoin(self.make_dir(), 'refs.sqlite')
+        self.refdb = SqliteRefdb(self.db_path)
+
+    def tearDown(self):
+        # The repository lets go of the store before it's closed
+        self.repo.close()
+        self.refdb.close()
+        super(SqliteRefdbTest, self).tearDown()
+
+    def test_imports_existing_refs(self):
+        self.repo.use_refdb(self.refdb)
+        self.assertEqual(self.refdb.get('refs/heads/master'), (self.first, None))
+        self.assertEqual(self.refdb.get('HEAD'), (None, 'refs/heads/master'))
+        self.assertEqual(self.repo['master'].sha, self.first)
+        self.assertEqual(self.repo.head, self.first)
+
+    def test_writes_go_to_the_store(self):
+        self.repo.use_refdb(self.refdb)
+        branches = self.repo.branches
+        branches['refs/heads/topic'] = self.second
+        self.assertEqual(self.refdb.get('refs/heads/topic'), (self.second, None))
+        self.assertEqual(dict(branches.iteritems()),
+                         {'refs/heads/master': self.first, 'refs/heads/topic': self.second})
+        self.assertEqual(len(branches), 2)
+        self.assertEqual(self.refdb.count('refs/heads/'), 2)
+        self.assertEqual(self.repo['topic'].sha, self.second)
+
+        del branches['refs/heads/topic']
+        self.assertIsNone(self.refdb.get('refs/heads/topic'))
+        self.assertEqual(len(branches), 1)
+        self.assertRaises(KeyError, self.repo.__getitem__, 'topic')
+
+    def test_iterates_in_batches(self):
+        self.refdb.put_many(('refs/tags/v%04d' % idx, self.first, None) for idx in xrange(1500))
+        self.repo.use_refdb(self.refdb)
+        tags = dict(self.repo.tags.iteritems())
+        self.assertEqual(len(tags), 1500)
+        self.assertEqual(len(self.repo.tags), 1500)
+        self.assertEqual(set(tags.itervalues()), set([self.first]))
+
+    def test_survives_reopening(self):
+        self.repo.use_refdb(self.refdb)
+        self.repo.branches['refs/heads/topic'] = self.second
+        self.repo.close()
+        self.repo.open()
+        self.assertEqual(self.repo['topic'].sha, self.second)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import shutil
+import tempfile
+import unittest
+
+from pyggy.objects import Blob, Commit, Timestamp, Tree, TreeEntry, User
+from pyggy.repo import Repo
+from pyggy.core import lib
+
+
+class ReferenceDbTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.repo = Repo(self.path)
+        self.repo.create(bare=True)
+
+        blob = Blob(self.repo)
+        blob.data = 'hello\n'
+        blob.write()
+        tree = Tree(self.repo)
+        tree.add_entry(TreeEntry('hello', blob.sha, lib.GIT_FILEMODE_BLOB))
+        tree.write()
+        commit = Commit(self.repo)
+        commit.tree = tree
+        commit.committer = User('pyggy', 'pyggy@example.com', Timestamp(1380000000, 0))
+        commit.message = 'initial\n'
+        commit.parent_ids = []
+        commit.write()
+        self.sha = commit.sha
+
+    def tearDown(self):
+        self.repo.close()
+        shutil.rmtree(self.path)
+
+    def test_assign_and_delete_branch(self):
+        branches = self.repo.branches
+        branches['refs/heads/topic'] = self.sha
+        self.assertEqual(dict(branches.iteritems()).get('refs/heads/topic'), self.sha)
+        self.assertEqual(self.repo['topic'].sha, self.sha)
+
+        del branches['refs/heads/topic']
+        self.assertNotIn('refs/heads/topic', dict(branches.iteritems()))
+        self.assertRaises(KeyError, self.repo.__getitem__, 'topic')
+
+
+if __name__ == '__main__':
+    unittest.main()
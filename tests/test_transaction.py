@@ -0,0 +1,45 @@
+import unittest
+
+from .helpers import RepoTestCase, write_commit
+
+FILES = {
+    'README': 'hello\n',
+    'src': {'main.c': 'int main() { return 0; }\n'},
+    # Git sorts this before the src directory, which sorts as 'src/'
+    'src.txt': 'notes\n',
+}
+
+
+class TransactionTest(RepoTestCase):
+    def test_objects_hash_the_same_inside_and_outside(self):
+        loose = write_commit(self.repo, FILES, message='initial\n')
+        packed_repo = self.make_repo()
+        with packed_repo.transaction():
+            packed = write_commit(packed_repo, FILES, message='initial\n')
+        self.assertEqual(packed, loose)
+
+        child_files = dict(FILES, README='changed\n')
+        loose_child = write_commit(self.repo, child_files, parents=[loose], message='second\n')
+        with packed_repo.transaction():
+            packed_child = write_commit(packed_repo, child_files, parents=[packed], message='second\n')
+        self.assertEqual(packed_child, loose_child)
+
+    def test_objects_readable_after_commit(self):
+        with self.repo.transaction() as transaction:
+            sha = write_commit(self.repo, FILES)
+            self.assertEqual(len(transaction), 6)
+        commit = self.repo.commit(sha)
+        self.assertEqual(self.repo.blob(commit.tree.lookup('README').sha).data, 'hello\n')
+
+    def test_rollback_writes_nothing(self):
+        try:
+            with self.repo.transaction():
+                sha = write_commit(self.repo, FILES)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(self.repo.contains_object(sha))
+
+
+if __name__ == '__main__':
+    unittest.main()